@@ -6,36 +6,66 @@ import threading
 import openpyxl
 from openpyxl.utils import column_index_from_string, get_column_letter
 import translator
+import translation_memory
+import excel_io
+import pipeline
 import logging
-import time
 from logging.handlers import RotatingFileHandler
 import io
 import sys
+import queue
 import requests
 
 # --- 日志和字体配置 ---
 class TextWidgetHandler(logging.Handler):
-    def __init__(self, text_widget):
+    def __init__(self, text_widget, max_lines=5000, flush_interval=100):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        self.records = queue.SimpleQueue()
         self.text_widget.tag_configure("INFO", foreground="black")
         self.text_widget.tag_configure("DEBUG", foreground="gray")
         self.text_widget.tag_configure("WARNING", foreground="orange")
         self.text_widget.tag_configure("ERROR", foreground="red")
         self.text_widget.tag_configure("CRITICAL", foreground="red", font=("Microsoft YaHei UI", 10, "bold"))
+        self.text_widget.after(self.flush_interval, self._flush)
 
     def emit(self, record):
-        msg = self.format(record)
-        def append_log():
-            try:
+        # May be called from any thread; only _flush touches the widget, on the Tk thread.
+        try:
+            self.records.put((self.format(record), record.levelname))
+        except Exception:
+            self.handleError(record)
+
+    def _flush(self):
+        pending = []
+        try:
+            while True:
+                pending.append(self.records.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            if pending:
+                # Anything older than the retained window would be trimmed right away, so skip it.
+                pending = pending[-self.max_lines:]
                 self.text_widget.config(state=tk.NORMAL)
-                self.text_widget.insert(tk.END, msg + "\n", record.levelname)
+                chunk, chunk_level = [], None
+                for msg, level in pending:
+                    if chunk and level != chunk_level:
+                        self.text_widget.insert(tk.END, "".join(chunk), chunk_level)
+                        chunk = []
+                    chunk_level = level
+                    chunk.append(msg + "\n")
+                self.text_widget.insert(tk.END, "".join(chunk), chunk_level)
+                line_count = int(self.text_widget.index("end-1c").split(".")[0])
+                if line_count > self.max_lines:
+                    self.text_widget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
                 self.text_widget.see(tk.END)
                 self.text_widget.config(state=tk.DISABLED)
-            except tk.TclError:
-                pass
-        if self.text_widget.winfo_exists():
-            self.text_widget.after(0, append_log)
+            self.text_widget.after(self.flush_interval, self._flush)
+        except tk.TclError:
+            pass
 
 logger = logging.getLogger() 
 logger.setLevel(logging.DEBUG)
@@ -60,8 +90,8 @@ class ExcelPreview(ttk.Frame):
         super().__init__(parent, *args, **kwargs)
         self.app_instance = app_instance
         self.canvas = tk.Canvas(self, bg="white", bd=2, relief="sunken")
-        self.v_scroll = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
-        self.h_scroll = ttk.Scrollbar(self, orient="horizontal", command=self.canvas.xview)
+        self.v_scroll = ttk.Scrollbar(self, orient="vertical", command=self._on_yview)
+        self.h_scroll = ttk.Scrollbar(self, orient="horizontal", command=self._on_xview)
         self.canvas.configure(yscrollcommand=self.v_scroll.set, xscrollcommand=self.h_scroll.set)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.v_scroll.pack(side=tk.RIGHT, fill="y")
@@ -69,32 +99,97 @@ class ExcelPreview(ttk.Frame):
         self.canvas.bind("<Configure>", self._on_canvas_configure)
         self.canvas.bind("<Button-1>", self._on_left_click)
         self.canvas.bind("<Button-3>", self._on_right_click)
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", self._on_mousewheel)
+        self.canvas.bind("<Button-5>", self._on_mousewheel)
         self.sheet = None
         self.cell_width = 100
         self.cell_height = 25
         self.header_height = 25
         self.row_header_width = 50
+        self.canvas.configure(xscrollincrement=self.cell_width, yscrollincrement=self.cell_height)
+        # Rows/columns drawn beyond the visible edge so small scrolls don't show blank strips.
+        self.viewport_margin = 5
         self.selected_src_col = None
         self.selected_src_row = None
         self.selected_tgt_col = None
         self.drawn_rects = {}
+        self._drawn_range = (1, 0, 1, 0)
+        # Covered (non-anchor) cell -> its merge anchor, and anchor -> (min_row, min_col, max_row, max_col).
+        self.merged_anchor = {}
+        self.merged_spans = {}
+        self._indexed_merged_ranges = None
+        self._redraw_pending = False
     def _on_canvas_configure(self, event):
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        self._schedule_redraw()
+    def _on_yview(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_redraw()
+    def _on_xview(self, *args):
+        self.canvas.xview(*args)
+        self._schedule_redraw()
+    def _on_mousewheel(self, event):
+        step = -3 if event.num == 4 or event.delta > 0 else 3
+        self.canvas.yview_scroll(step, "units")
+        self._schedule_redraw()
+    def _schedule_redraw(self):
+        # Scroll and resize events arrive in bursts; redraw once when Tk is idle.
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self._redraw)
+    def _redraw(self):
+        self._redraw_pending = False
         self.draw_sheet()
+    def _index_merged_cells(self):
+        self.merged_anchor = {}
+        self.merged_spans = {}
+        self._indexed_merged_ranges = self.sheet.merged_ranges if self.sheet else None
+        if not self.sheet: return
+        for min_row, min_col, max_row, max_col in self.sheet.merged_ranges:
+            anchor = (min_row, min_col)
+            self.merged_spans[anchor] = (min_row, min_col, max_row, max_col)
+            for r_idx in range(min_row, max_row + 1):
+                for c_idx in range(min_col, max_col + 1):
+                    if (r_idx, c_idx) != anchor:
+                        self.merged_anchor[(r_idx, c_idx)] = anchor
     def load_sheet(self, sheet):
+        """`sheet` is an excel_io.SheetPreviewData that may still be loading; call refresh() as rows arrive."""
         self.sheet = sheet
+        self._index_merged_cells()
         self.selected_src_col = None
         self.selected_src_row = None
         self.selected_tgt_col = None
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
         self.draw_sheet()
         self.app_instance.update_selection_display()
+    def refresh(self):
+        if self.sheet and self.sheet.merged_ranges is not self._indexed_merged_ranges:
+            self._index_merged_cells()
+        self._schedule_redraw()
+    def _visible_range(self, max_row, max_col):
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        width = max(self.canvas.winfo_width(), 1)
+        height = max(self.canvas.winfo_height(), 1)
+        first_col = max(1, int((x0 - self.row_header_width) / self.cell_width) + 1 - self.viewport_margin)
+        last_col = min(max_col, int((x0 + width - self.row_header_width) / self.cell_width) + 1 + self.viewport_margin)
+        first_row = max(1, int((y0 - self.header_height) / self.cell_height) + 1 - self.viewport_margin)
+        last_row = min(max_row, int((y0 + height - self.header_height) / self.cell_height) + 1 + self.viewport_margin)
+        return first_row, last_row, first_col, last_col
     def draw_sheet(self):
         if not self.sheet: return
         self.canvas.delete("all")
         self.drawn_rects = {}
         max_row = self.sheet.max_row
         max_col = self.sheet.max_column
-        for c_idx in range(1, max_col + 1):
+        self.canvas.config(scrollregion=(0, 0, self.row_header_width + max_col * self.cell_width, self.header_height + max_row * self.cell_height))
+        # Only the viewport is drawn; scrolling or resizing redraws it.
+        first_row, last_row, first_col, last_col = self._visible_range(max_row, max_col)
+        self._drawn_range = (first_row, last_row, first_col, last_col)
+        if not self.sheet.finished and last_row + self.viewport_margin > len(self.sheet.rows):
+            self.sheet.request_rows(last_row + self.sheet.chunk_rows)
+        for c_idx in range(first_col, last_col + 1):
             col_letter = openpyxl.utils.get_column_letter(c_idx)
             x1 = self.row_header_width + (c_idx - 1) * self.cell_width
             y1 = 0
@@ -102,30 +197,25 @@ class ExcelPreview(ttk.Frame):
             y2 = self.header_height
             self.canvas.create_rectangle(x1, y1, x2, y2, outline="gray", fill="#f0f0f0", tags=f"col_header_bg_{c_idx}")
             self.canvas.create_text(x1 + self.cell_width / 2, y1 + self.header_height / 2, text=col_letter, font=HEADER_FONT)
-        for r_idx in range(1, max_row + 1):
+        for r_idx in range(first_row, last_row + 1):
             x1 = 0
             y1 = self.header_height + (r_idx - 1) * self.cell_height
             x2 = self.row_header_width
             y2 = y1 + self.cell_height
             self.canvas.create_rectangle(x1, y1, x2, y2, outline="gray", fill="#f0f0f0")
             self.canvas.create_text(x1 + self.row_header_width / 2, y1 + self.cell_height / 2, text=str(r_idx), font=HEADER_FONT)
-        for r_idx in range(1, max_row + 1):
-            for c_idx in range(1, max_col + 1):
-                cell = self.sheet.cell(row=r_idx, column=c_idx)
+        for r_idx in range(first_row, last_row + 1):
+            for c_idx in range(first_col, last_col + 1):
                 x1 = self.row_header_width + (c_idx - 1) * self.cell_width
                 y1 = self.header_height + (r_idx - 1) * self.cell_height
                 x2 = x1 + self.cell_width
                 y2 = y1 + self.cell_height
                 rect_id = self.canvas.create_rectangle(x1, y1, x2, y2, outline="gray", fill="white")
                 self.drawn_rects[(r_idx, c_idx)] = rect_id
-                display_value = cell.value
-                for merged_range in self.sheet.merged_cells.ranges:
-                    if cell.coordinate in merged_range and cell.coordinate != merged_range.coord.split(':')[0]:
-                        display_value = ""
-                        break
+                display_value = "" if (r_idx, c_idx) in self.merged_anchor else self.sheet.value(r_idx, c_idx)
                 self.canvas.create_text(x1 + 5, y1 + self.cell_height / 2, text=str(display_value) if display_value is not None else "", anchor="w", font=DEFAULT_FONT)
-        self.canvas.config(scrollregion=(0, 0, self.row_header_width + max_col * self.cell_width, self.header_height + max_row * self.cell_height))
-        self._highlight_selections()
+        # Everything was just drawn unselected, so only the selected cells need painting.
+        self._highlight_selections((None, None, None))
     def _get_cell_from_coords(self, x, y):
         canvas_x = self.canvas.canvasx(x)
         canvas_y = self.canvas.canvasy(y)
@@ -137,38 +227,58 @@ class ExcelPreview(ttk.Frame):
     def _on_left_click(self, event):
         row, col = self._get_cell_from_coords(event.x, event.y)
         if row is not None and col is not None:
+            # The start cell is the merge anchor, which holds the value; the target column stays where it was clicked.
+            row, col = self.merged_anchor.get((row, col), (row, col))
+            previous = self._selection_state()
             self.selected_src_col = col
             self.selected_src_row = row
-            self._highlight_selections()
+            self._highlight_selections(previous)
             self.app_instance.update_selection_display()
     def _on_right_click(self, event):
         row, col = self._get_cell_from_coords(event.x, event.y)
         if col is not None:
+            previous = self._selection_state()
             self.selected_tgt_col = col
-            self._highlight_selections()
+            self._highlight_selections(previous)
             self.app_instance.update_selection_display()
         return "break"
-    def _highlight_selections(self):
-        for (r, c), rect_id in self.drawn_rects.items(): self.canvas.itemconfig(rect_id, fill="white")
-        if self.sheet:
-            for c_idx in range(1, self.sheet.max_column + 1):
-                col_header_bg_id = self.canvas.find_withtag(f"col_header_bg_{c_idx}")
-                if col_header_bg_id: self.canvas.itemconfig(col_header_bg_id, fill="#f0f0f0")
-        if self.selected_tgt_col and self.sheet:
-            for r_idx in range(1, self.sheet.max_row + 1):
-                rect_id = self.drawn_rects.get((r_idx, self.selected_tgt_col))
-                if rect_id: self.canvas.itemconfig(rect_id, fill="#e0e0ff")
-            col_header_bg_id = self.canvas.find_withtag(f"col_header_bg_{self.selected_tgt_col}")
-            if col_header_bg_id: self.canvas.itemconfig(col_header_bg_id, fill="#c0c0ff")
-        if self.selected_src_col and self.sheet:
-            for r_idx in range(1, self.sheet.max_row + 1):
-                rect_id = self.drawn_rects.get((r_idx, self.selected_src_col))
-                if rect_id: self.canvas.itemconfig(rect_id, fill="#e0ffe0")
-            col_header_bg_id = self.canvas.find_withtag(f"col_header_bg_{self.selected_src_col}")
-            if col_header_bg_id: self.canvas.itemconfig(col_header_bg_id, fill="#c0ffc0")
-        if self.selected_src_col and self.selected_src_row:
-            rect_id = self.drawn_rects.get((self.selected_src_row, self.selected_src_col))
-            if rect_id: self.canvas.itemconfig(rect_id, fill="#66ff66", outline='red', width=2)
+    def _selection_state(self):
+        return self.selected_src_col, self.selected_src_row, self.selected_tgt_col
+    def _start_span(self, src_col, src_row):
+        if not src_col or not src_row: return None
+        return self.merged_spans.get((src_row, src_col), (src_row, src_col, src_row, src_col))
+    def _cell_style(self, r_idx, c_idx, start_span):
+        if start_span and start_span[0] <= r_idx <= start_span[2] and start_span[1] <= c_idx <= start_span[3]:
+            return "#66ff66", "red", 2
+        if c_idx == self.selected_src_col: return "#e0ffe0", "gray", 1
+        if c_idx == self.selected_tgt_col: return "#e0e0ff", "gray", 1
+        return "white", "gray", 1
+    def _header_fill(self, c_idx):
+        if c_idx == self.selected_src_col: return "#c0ffc0"
+        if c_idx == self.selected_tgt_col: return "#c0c0ff"
+        return "#f0f0f0"
+    def _highlight_selections(self, previous):
+        """Repaints only the drawn cells whose state may differ from `previous` (src_col, src_row, tgt_col)."""
+        if not self.sheet: return
+        prev_src_col, prev_src_row, prev_tgt_col = previous
+        columns = set()
+        if prev_src_col != self.selected_src_col: columns.update((prev_src_col, self.selected_src_col))
+        if prev_tgt_col != self.selected_tgt_col: columns.update((prev_tgt_col, self.selected_tgt_col))
+        columns.discard(None)
+        first_row, last_row, _, _ = self._drawn_range
+        cells = {(r_idx, c_idx) for c_idx in columns for r_idx in range(first_row, last_row + 1)}
+        start_span = self._start_span(self.selected_src_col, self.selected_src_row)
+        for span in (self._start_span(prev_src_col, prev_src_row), start_span):
+            if span:
+                cells.update((r_idx, c_idx) for r_idx in range(span[0], span[2] + 1) for c_idx in range(span[1], span[3] + 1))
+        for r_idx, c_idx in cells:
+            rect_id = self.drawn_rects.get((r_idx, c_idx))
+            if rect_id:
+                fill, outline, width = self._cell_style(r_idx, c_idx, start_span)
+                self.canvas.itemconfig(rect_id, fill=fill, outline=outline, width=width)
+        for c_idx in columns:
+            col_header_bg_id = self.canvas.find_withtag(f"col_header_bg_{c_idx}")
+            if col_header_bg_id: self.canvas.itemconfig(col_header_bg_id, fill=self._header_fill(c_idx))
     def get_selected_source_coords(self):
         if self.selected_src_col and self.selected_src_row: return openpyxl.utils.get_column_letter(self.selected_src_col), self.selected_src_row
         return None, None
@@ -178,15 +288,17 @@ class ExcelPreview(ttk.Frame):
     def set_selected_source_coords(self, col_letter, row):
         if col_letter and row:
             try:
+                previous = self._selection_state()
                 self.selected_src_col = openpyxl.utils.column_index_from_string(col_letter)
                 self.selected_src_row = int(row)
-                self._highlight_selections()
+                self._highlight_selections(previous)
             except (ValueError, TypeError): pass
     def set_selected_target_col(self, col_letter):
         if col_letter:
             try:
+                previous = self._selection_state()
                 self.selected_tgt_col = openpyxl.utils.column_index_from_string(col_letter)
-                self._highlight_selections()
+                self._highlight_selections(previous)
             except ValueError: pass
 
 # --- ProxyManagerWindow 类 (无变化) ---
@@ -364,6 +476,10 @@ class ProxyManagerWindow(tk.Toplevel):
 
 # --- ModelManagerWindow 类 (已重构) ---
 class ModelManagerWindow(tk.Toplevel):
+    # Keys this window edits. Anything else in a model's entry (batch_token_budget, max_retries, ...) is only set in
+    # config.json and must survive an edit here.
+    FORM_KEYS = ("provider", "api_key", "model_id", "api_url", "response_mode", "stream", "requests_per_minute", "tokens_per_minute")
+
     def __init__(self, parent, app_instance):
         super().__init__(parent)
         self.title("AI模型管理")
@@ -380,6 +496,10 @@ class ModelManagerWindow(tk.Toplevel):
         
         self.model_id_var = tk.StringVar()
         self.custom_api_url_var = tk.StringVar()
+        self.rpm_var = tk.StringVar()
+        self.tpm_var = tk.StringVar()
+        self.response_mode_var = tk.StringVar(value="分隔符")
+        self.stream_var = tk.BooleanVar(value=False)
 
         self._create_widgets()
         self._load_models_to_treeview()
@@ -399,6 +519,16 @@ class ModelManagerWindow(tk.Toplevel):
         provider_combo = ttk.Combobox(common_frame, textvariable=self.api_provider_var, values=["Gemini", "DeepSeek", "Custom"], state="readonly")
         provider_combo.grid(row=2, column=1, sticky=tk.EW, padx=5)
         provider_combo.bind("<<ComboboxSelected>>", self._toggle_provider_fields)
+
+        ttk.Label(common_frame, text="每分钟请求数 RPM (可选):").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(common_frame, textvariable=self.rpm_var).grid(row=3, column=1, sticky=tk.EW, padx=5)
+
+        ttk.Label(common_frame, text="每分钟Token数 TPM (可选):").grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(common_frame, textvariable=self.tpm_var).grid(row=4, column=1, sticky=tk.EW, padx=5)
+
+        ttk.Label(common_frame, text="返回格式:").grid(row=5, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Combobox(common_frame, textvariable=self.response_mode_var, values=["分隔符", "JSON"], state="readonly").grid(row=5, column=1, sticky=tk.EW, padx=5)
+        ttk.Checkbutton(common_frame, text="流式返回 (JSON格式下逐条保存译文)", variable=self.stream_var).grid(row=6, column=1, sticky=tk.W, padx=5, pady=5)
         
         common_frame.columnconfigure(1, weight=1)
 
@@ -526,6 +656,10 @@ class ModelManagerWindow(tk.Toplevel):
             self.model_id_var.set(saved_model_id)
             
             self.custom_api_url_var.set(details.get("api_url", ""))
+            self.rpm_var.set(str(details.get("requests_per_minute") or ""))
+            self.tpm_var.set(str(details.get("tokens_per_minute") or ""))
+            self.response_mode_var.set("JSON" if details.get("response_mode") == translator.RESPONSE_MODE_JSON else "分隔符")
+            self.stream_var.set(bool(details.get("stream")))
         self._toggle_provider_fields()
 
     def _collect_and_validate(self):
@@ -550,6 +684,22 @@ class ModelManagerWindow(tk.Toplevel):
                 return None
             details["api_url"] = api_url
 
+        if self.response_mode_var.get() == "JSON":
+            details["response_mode"] = translator.RESPONSE_MODE_JSON
+        if self.stream_var.get():
+            details["stream"] = True
+
+        for key, var, label in (("requests_per_minute", self.rpm_var, "RPM"), ("tokens_per_minute", self.tpm_var, "TPM")):
+            value = var.get().strip()
+            if not value:
+                continue
+            try:
+                details[key] = int(value)
+                if details[key] <= 0: raise ValueError
+            except ValueError:
+                messagebox.showerror("错误", f"{label} 必须是正整数或留空！", parent=self)
+                return None
+
         return name, details
 
     def _add_model(self):
@@ -574,9 +724,10 @@ class ModelManagerWindow(tk.Toplevel):
         if original_name != name and name in self.models:
             messagebox.showerror("错误", f"新的配置名称 '{name}' 已存在！", parent=self)
             return
+        kept = {key: value for key, value in self.models[original_name].items() if key not in self.FORM_KEYS}
         if original_name != name:
             del self.models[original_name]
-        self.models[name] = details
+        self.models[name] = {**kept, **details}
         self._save_and_update()
         if self.app_instance.current_model_name_var.get() == original_name:
             self.app_instance.current_model_name_var.set(name)
@@ -602,6 +753,33 @@ class ModelManagerWindow(tk.Toplevel):
         self.grab_release()
         self.destroy()
 
+class ModelPoolWindow(tk.Toplevel):
+    def __init__(self, parent, app_instance):
+        super().__init__(parent)
+        self.title("模型池")
+        self.app_instance = app_instance
+        self.transient(parent)
+        self.grab_set()
+        ttk.Label(self, text="勾选两个或以上的模型配置后，批次会按各模型的实际吞吐量和剩余配额分配，\n某个模型失败或被限速时自动改用其他模型。", padding="10").pack(fill=tk.X)
+        list_frame = ttk.Frame(self, padding="10")
+        list_frame.pack(fill=tk.BOTH, expand=True)
+        self.selection_vars = {}
+        for name in self.app_instance.models:
+            var = tk.BooleanVar(value=name in self.app_instance.model_pool_names)
+            ttk.Checkbutton(list_frame, text=name, variable=var).pack(anchor=tk.W)
+            self.selection_vars[name] = var
+        ttk.Button(self, text="确定", command=self._on_confirm).pack(pady=10)
+
+    def _on_confirm(self):
+        names = [name for name, var in self.selection_vars.items() if var.get()]
+        self.app_instance.model_pool_names = names
+        if len(names) > 1:
+            logger.info(f"已启用模型池: {', '.join(names)}")
+        else:
+            logger.info("模型池未启用，将只使用当前选择的AI模型配置。")
+        self.app_instance.save_config(self.app_instance.config_file)
+        self.destroy()
+
 # --- 主应用 TranslatorApp (已重构) ---
 class TranslatorApp(tk.Tk):
     def __init__(self):
@@ -615,6 +793,7 @@ class TranslatorApp(tk.Tk):
         
         self.models = {} 
         self.proxies = {}
+        self.model_pool_names = []
         
         self.current_model_name_var = tk.StringVar()
         self.current_proxy_name_var = tk.StringVar(value="无代理")
@@ -624,6 +803,15 @@ class TranslatorApp(tk.Tk):
         self.src_col_var = tk.StringVar()
         self.tgt_col_var = tk.StringVar()
         self.src_row_var = tk.StringVar()
+        self.load_status_var = tk.StringVar()
+        self.progress_var = tk.StringVar()
+        self.preview_data = None
+        self.max_concurrency_var = tk.StringVar(value="3")
+        self.use_translation_memory_var = tk.BooleanVar(value=True)
+        self.hedge_requests_var = tk.BooleanVar(value=False)
+        self.hedge_model_var = tk.StringVar(value="同一模型")
+        self.translation_memory = None
+        self.translation_memory_max_entries = translation_memory.DEFAULT_MAX_ENTRIES
         
         self._create_widgets()
         self.load_config(self.config_file) 
@@ -657,6 +845,7 @@ class TranslatorApp(tk.Tk):
         ttk.Label(file_preview_frame, textvariable=self.selected_src_display_var, foreground="green").grid(row=2, column=1, sticky=tk.W, padx=5, pady=2)
         ttk.Label(file_preview_frame, text="目标语言列: ").grid(row=3, column=0, sticky=tk.W, padx=5, pady=2)
         ttk.Label(file_preview_frame, textvariable=self.selected_tgt_display_var, foreground="blue").grid(row=3, column=1, sticky=tk.W, padx=5, pady=2)
+        ttk.Label(file_preview_frame, textvariable=self.load_status_var, foreground="gray").grid(row=3, column=2, sticky=tk.E, padx=5, pady=2)
         self.excel_preview = ExcelPreview(file_preview_frame, self)
         self.excel_preview.grid(row=1, column=0, columnspan=3, sticky=tk.NSEW, pady=5)
 
@@ -668,11 +857,14 @@ class TranslatorApp(tk.Tk):
         ttk.Entry(lang_frame, textvariable=self.src_lang_var).grid(row=0, column=1, padx=5)
         ttk.Label(lang_frame, text="目标语言:").grid(row=0, column=2, sticky=tk.W, padx=5, pady=5)
         ttk.Entry(lang_frame, textvariable=self.tgt_lang_var).grid(row=0, column=3, padx=5)
+        self.extra_targets_var = tk.StringVar()
+        ttk.Label(lang_frame, text="其他目标(列=语言):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(lang_frame, textvariable=self.extra_targets_var).grid(row=1, column=1, columnspan=3, sticky=tk.EW, padx=5)
         
         api_proxy_frame = ttk.LabelFrame(control_panel_frame, text="3. AI与网络设置", padding="10")
         api_proxy_frame.grid(row=2, column=0, sticky="nsew", pady=5)
         api_proxy_frame.columnconfigure(1, weight=1)
-        api_proxy_frame.rowconfigure(2, weight=1)
+        api_proxy_frame.rowconfigure(3, weight=1)
 
         ttk.Label(api_proxy_frame, text="网络代理:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
         self.proxy_combobox = ttk.Combobox(api_proxy_frame, textvariable=self.current_proxy_name_var, state="readonly")
@@ -685,15 +877,26 @@ class TranslatorApp(tk.Tk):
         self.model_combobox.bind("<<ComboboxSelected>>", self.on_model_selected)
         ttk.Button(api_proxy_frame, text="模型管理...", command=self.open_model_manager).grid(row=1, column=2, padx=5)
         
-        ttk.Label(api_proxy_frame, text="提示词模板:").grid(row=2, column=0, sticky=tk.NW, padx=5, pady=5)
+        ttk.Label(api_proxy_frame, text="并发批次数:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        concurrency_frame = ttk.Frame(api_proxy_frame)
+        concurrency_frame.grid(row=2, column=1, sticky=tk.EW, padx=5)
+        ttk.Spinbox(concurrency_frame, from_=1, to=32, textvariable=self.max_concurrency_var, width=8).pack(side=tk.LEFT)
+        self.hedge_model_combobox = ttk.Combobox(concurrency_frame, textvariable=self.hedge_model_var, state="readonly", width=16)
+        self.hedge_model_combobox.pack(side=tk.RIGHT)
+        ttk.Checkbutton(concurrency_frame, text="对冲慢批次，发往:", variable=self.hedge_requests_var).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(api_proxy_frame, text="模型池...", command=self.open_model_pool).grid(row=2, column=2, padx=5)
+
+        ttk.Label(api_proxy_frame, text="提示词模板:").grid(row=3, column=0, sticky=tk.NW, padx=5, pady=5)
         self.prompt_text = tk.Text(api_proxy_frame, height=12, wrap=tk.WORD)
-        self.prompt_text.grid(row=2, column=1, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
+        self.prompt_text.grid(row=3, column=1, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
 
         control_buttons_frame = ttk.Frame(control_panel_frame)
         control_buttons_frame.grid(row=3, column=0, sticky=tk.E, pady=10)
         self.start_button = ttk.Button(control_buttons_frame, text="开始翻译", command=self.start_translation)
         self.start_button.pack(side=tk.RIGHT, padx=5)
         ttk.Button(control_buttons_frame, text="保存配置", command=lambda: self.save_config(self.config_file)).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(control_buttons_frame, text="使用翻译记忆", variable=self.use_translation_memory_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_buttons_frame, text="清除翻译记忆", command=self.clear_translation_memory).pack(side=tk.LEFT, padx=5)
         
         log_panel_frame.rowconfigure(0, weight=1)
         log_panel_frame.columnconfigure(0, weight=1)
@@ -702,11 +905,17 @@ class TranslatorApp(tk.Tk):
         status_scroll = ttk.Scrollbar(log_panel_frame, orient="vertical", command=self.status_text.yview)
         status_scroll.grid(row=0, column=1, sticky="ns")
         self.status_text.configure(yscrollcommand=status_scroll.set)
+        ttk.Label(log_panel_frame, textvariable=self.progress_var).grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
 
     def start_translation(self):
         if not self.file_path_var.get() or not self.src_col_var.get() or not self.tgt_col_var.get() or not self.src_row_var.get():
             messagebox.showerror("错误", "请先选择Excel文件、源语言的起始单元格和目标语言列。")
             return
+        try:
+            pipeline.parse_targets(self.extra_targets_var.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
         model_name = self.current_model_name_var.get()
         if not model_name or model_name not in self.models:
             messagebox.showerror("错误", "请选择一个有效的AI模型配置。")
@@ -722,103 +931,103 @@ class TranslatorApp(tk.Tk):
         threading.Thread(target=self._translation_worker, daemon=True).start()
 
     def _translation_worker(self):
-        workbook = None
-        file_path = self.file_path_var.get()
+        hedged_translator = None
         try:
             model_details = self.models[self.current_model_name_var.get()]
             proxy_name = self.current_proxy_name_var.get()
             proxy_config = self.proxies.get(proxy_name) if proxy_name != "无代理" else None
+            max_concurrency = self.get_max_concurrency()
+
+            pool_names = [name for name in self.model_pool_names if name in self.models]
+            if len(pool_names) > 1:
+                self.translator = pipeline.create_translator_pool(self.models, pool_names, proxy_config, pool_size=max_concurrency)
+            else:
+                # Hedging runs each batch on worker threads, so it keeps the synchronous engine.
+                use_async = False if self.hedge_requests_var.get() else None
+                self.translator = pipeline.create_translator(model_details, proxy_config, pool_size=max_concurrency, use_async=use_async)
+            if self.hedge_requests_var.get():
+                hedge_details = self.models.get(self.hedge_model_var.get())
+                secondary = pipeline.create_translator(hedge_details, proxy_config, pool_size=max_concurrency, use_async=False) if hedge_details else None
+                self.translator = hedged_translator = pipeline.create_hedged_translator(self.translator, secondary, max_concurrency)
 
-            self.translator = translator.Translator(
-                api_key=model_details.get("api_key"),
-                model_id=model_details.get("model_id"),
-                api_provider=model_details.get("provider"),
-                custom_api_url=model_details.get("api_url"),
-                proxy_config=proxy_config
+            job = pipeline.TranslationJob(
+                self.file_path_var.get(),
+                self.src_col_var.get(),
+                self.tgt_col_var.get(),
+                self.src_row_var.get(),
+                self.src_lang_var.get(),
+                self.tgt_lang_var.get(),
+                self.prompt_text.get("1.0", tk.END),
+                preview_data=self.preview_data,
+                extra_targets=pipeline.parse_targets(self.extra_targets_var.get())
+            )
+            pipeline.run_translation_job(
+                job,
+                self.translator,
+                max_concurrency,
+                memory=self.get_translation_memory(),
+                on_progress=lambda progress: self.after(0, self.progress_var.set, progress.describe())
             )
-            
-            workbook = openpyxl.load_workbook(file_path)
-            sheet = workbook.active
-            src_col_idx = openpyxl.utils.column_index_from_string(self.src_col_var.get())
-            tgt_col_idx = openpyxl.utils.column_index_from_string(self.tgt_col_var.get())
-            start_row = int(self.src_row_var.get())
-            
-            all_sources = []
-            row_map = []
-            for r_idx in range(start_row, sheet.max_row + 1):
-                cell_value = sheet.cell(row=r_idx, column=src_col_idx).value
-                all_sources.append(str(cell_value) if cell_value is not None else "")
-                row_map.append(r_idx)
-
-            if not any(s.strip() for s in all_sources):
-                logger.info("在指定列中未找到需要翻译的文本。")
-                self.after(0, lambda: messagebox.showinfo("完成", "未找到需要翻译的文本。"))
-                return
 
-            logger.info(f"共找到 {len(all_sources)} 行文本准备翻译。")
-
-            prompt_template = self.prompt_text.get("1.0", tk.END)
-            source_language = self.src_lang_var.get()
-            target_language = self.tgt_lang_var.get()
-            batch_size = 100
-            all_results_valid = True
-
-            for i in range(0, len(all_sources), batch_size):
-                batch_sources = all_sources[i:i+batch_size]
-                batch_row_map = row_map[i:i+batch_size]
-                
-                logger.info(f"正在处理批次 (行 {batch_row_map[0]}-{batch_row_map[-1]})...")
-
-                translated_texts = self.translator.translate_batch(
-                    batch_sources, 
-                    prompt_template, 
-                    source_language, 
-                    target_language
-                )
-
-                if len(translated_texts) != len(batch_sources):
-                    logger.error(f"批次翻译失败: 返回结果数量 ({len(translated_texts)}) 与源文本数量 ({len(batch_sources)}) 不匹配。")
-                    all_results_valid = False
-                    for original_row in batch_row_map:
-                        sheet.cell(row=original_row, column=tgt_col_idx).value = "[批次翻译失败:行数不匹配]"
-                else:
-                    for j, original_row in enumerate(batch_row_map):
-                        sheet.cell(row=original_row, column=tgt_col_idx).value = translated_texts[j]
-                
-                logger.info(f"批次 (行 {batch_row_map[0]}-{batch_row_map[-1]}) 已在内存中处理完成。")
-                time.sleep(1)
-            
-            if all_results_valid:
-                logger.info("所有批次处理完毕，准备保存文件...")
+            if not job.total_rows:
+                self.after(0, lambda: messagebox.showinfo("完成", "未找到需要翻译的文本。"))
             else:
-                logger.warning("部分批次翻译失败，请检查Excel文件中的错误信息。准备保存文件...")
-
-            workbook.save(file_path)
-            logger.info(f"所有翻译任务完成并成功保存到文件: {file_path}")
-            self.after(0, lambda: messagebox.showinfo("完成", "所有翻译任务已完成！"))
+                self.after(0, lambda: messagebox.showinfo("完成", "所有翻译任务已完成！"))
 
         except Exception as e:
             logger.exception(f"翻译线程发生严重错误: {e}")
             self.after(0, lambda err=e: messagebox.showerror("错误", f"翻译过程中发生错误:\n{err}"))
         finally:
-            if workbook: workbook.close()
+            if hedged_translator:
+                hedged_translator.close()
             self.after(0, lambda: self.start_button.config(state=tk.NORMAL))
 
+    def get_max_concurrency(self):
+        try:
+            return min(max(int(self.max_concurrency_var.get()), 1), 32)
+        except (ValueError, TypeError):
+            return 1
+
+    def get_translation_memory(self):
+        if not self.use_translation_memory_var.get():
+            return None
+        if self.translation_memory is None:
+            self.translation_memory = translation_memory.TranslationMemory(max_entries=self.translation_memory_max_entries)
+        return self.translation_memory
+
+    def clear_translation_memory(self):
+        if not messagebox.askyesno("确认清除", "确定要清除所有已缓存的翻译结果吗？"):
+            return
+        try:
+            memory = self.translation_memory or translation_memory.TranslationMemory(max_entries=self.translation_memory_max_entries)
+            deleted = memory.clear()
+            messagebox.showinfo("完成", f"已清除 {deleted} 条翻译记忆。")
+        except Exception as e:
+            logger.error(f"清除翻译记忆失败: {e}")
+            messagebox.showerror("错误", f"清除翻译记忆失败:\n{e}")
+
     def get_default_prompt(self):
-        return f"You are an expert translator. Your task is to translate a batch of texts from {{source_language}} to {{target_language}}. The texts are separated by a unique delimiter: '{translator.LINE_SEPARATOR}'.\n\n**CRITICAL INSTRUCTIONS:**\n1.  Translate each segment of text between the delimiters individually.\n2.  You MUST preserve the exact same delimiter '{translator.LINE_SEPARATOR}' between each translated segment.\n3.  The number of delimiters in your output MUST be exactly one less than the number of text segments in the input.\n4.  If a segment in the input is empty or contains only whitespace, you MUST output an empty segment in its place, followed by the delimiter.\n5.  Do NOT add any extra text, explanations, or formatting. Your response should only contain the translated texts separated by the specified delimiter.\n\n**EXAMPLE:**\n- **INPUT TEXT:**\nHello world{translator.LINE_SEPARATOR}{translator.LINE_SEPARATOR}How are you?\n- **EXPECTED OUTPUT (to Spanish):**\nHola mundo{translator.LINE_SEPARATOR}{translator.LINE_SEPARATOR}¿Cómo estás?\n\n--- TEXT TO TRANSLATE ---\n{{text_to_translate}}"
+        return translator.DEFAULT_PROMPT_TEMPLATE
 
     def save_config(self, file_path):
         config_data = {
             "models": self.models,
             "proxies": self.proxies,
             "current_model_name": self.current_model_name_var.get(),
+            "model_pool": self.model_pool_names,
             "current_proxy_name": self.current_proxy_name_var.get(),
             "source_language": self.src_lang_var.get(),
             "target_language": self.tgt_lang_var.get(),
+            "extra_targets": self.extra_targets_var.get(),
             "prompt_template": self.prompt_text.get("1.0", tk.END).strip(),
             "src_col": self.src_col_var.get(),
             "tgt_col": self.tgt_col_var.get(),
-            "src_row": self.src_row_var.get()
+            "src_row": self.src_row_var.get(),
+            "max_concurrency": self.max_concurrency_var.get(),
+            "use_translation_memory": self.use_translation_memory_var.get(),
+            "hedge_requests": self.hedge_requests_var.get(),
+            "hedge_model": self.hedge_model_var.get() if self.hedge_model_var.get() in self.models else "",
+            "translation_memory_max_entries": self.translation_memory_max_entries
         }
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
@@ -861,10 +1070,12 @@ class TranslatorApp(tk.Tk):
         self.update_proxy_combobox()
 
         self.current_model_name_var.set(config_data.get("current_model_name", ""))
+        self.model_pool_names = config_data.get("model_pool", [])
         self.current_proxy_name_var.set(config_data.get("current_proxy_name", "无代理"))
         
         self.src_lang_var.set(config_data.get("source_language", "俄语"))
         self.tgt_lang_var.set(config_data.get("target_language", "简体中文"))
+        self.extra_targets_var.set(config_data.get("extra_targets", ""))
         
         prompt_from_config = config_data.get("prompt_template", "").strip()
         self.prompt_text.delete("1.0", tk.END)
@@ -873,12 +1084,19 @@ class TranslatorApp(tk.Tk):
         self.src_col_var.set(config_data.get("src_col", ""))
         self.tgt_col_var.set(config_data.get("tgt_col", ""))
         self.src_row_var.set(config_data.get("src_row", ""))
+        self.max_concurrency_var.set(str(config_data.get("max_concurrency", "3")))
+        self.use_translation_memory_var.set(config_data.get("use_translation_memory", True))
+        self.hedge_requests_var.set(config_data.get("hedge_requests", False))
+        hedge_model = config_data.get("hedge_model", "")
+        self.hedge_model_var.set(hedge_model if hedge_model in self.models else "同一模型")
+        self.translation_memory_max_entries = config_data.get("translation_memory_max_entries", translation_memory.DEFAULT_MAX_ENTRIES)
         
         self.on_model_selected()
         self.update_selection_display()
 
     def open_model_manager(self): ModelManagerWindow(self, self)
     def open_proxy_manager(self): ProxyManagerWindow(self, self)
+    def open_model_pool(self): ModelPoolWindow(self, self)
     
     def on_model_selected(self, event=None):
         model_name = self.current_model_name_var.get()
@@ -889,6 +1107,9 @@ class TranslatorApp(tk.Tk):
         self.model_combobox['values'] = model_names
         if self.current_model_name_var.get() not in model_names:
             self.current_model_name_var.set(model_names[0] if model_names else "")
+        self.hedge_model_combobox['values'] = ["同一模型"] + model_names
+        if self.hedge_model_var.get() not in model_names:
+            self.hedge_model_var.set("同一模型")
     
     def update_proxy_combobox(self):
         proxy_names = ["无代理"] + list(self.proxies.keys())
@@ -900,12 +1121,31 @@ class TranslatorApp(tk.Tk):
         file_path = filedialog.askopenfilename(filetypes=(("Excel files", "*.xlsx *.xls"), ("All files", "*.*的发展")))
         if file_path:
             self.file_path_var.set(file_path)
+            self.load_status_var.set("正在加载...")
+            if self.preview_data:
+                # Otherwise the old loader stays parked on its workbook for good.
+                self.preview_data.close()
             try:
-                workbook = openpyxl.load_workbook(file_path, data_only=True)
-                self.excel_preview.load_sheet(workbook.active)
+                # Parsing happens on a background thread; updates are marshalled back onto the Tk loop.
+                self.preview_data = excel_io.SheetPreviewData(file_path, on_update=lambda data: self.after(0, self._on_preview_data_update, data))
+                self.excel_preview.load_sheet(self.preview_data)
             except Exception as e:
+                self.load_status_var.set("")
                 messagebox.showerror("错误", f"无法加载Excel文件:\n{e}")
 
+    def _on_preview_data_update(self, data):
+        if data is not self.preview_data: return
+        if data.error:
+            self.load_status_var.set("加载失败")
+            messagebox.showerror("错误", f"无法加载Excel文件:\n{data.error}")
+            return
+        if data.finished:
+            self.load_status_var.set(f"已加载全部 {len(data.rows)} 行")
+        else:
+            total = f" / 约 {data.declared_rows}" if data.declared_rows else ""
+            self.load_status_var.set(f"已加载 {len(data.rows)}{total} 行，滚动时继续加载")
+        self.excel_preview.refresh()
+
     def update_selection_display(self):
         src_col, src_row = self.excel_preview.get_selected_source_coords()
         tgt_col = self.excel_preview.get_selected_target_col()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+import translator
+from metrics import RequestStats, TranslationMetrics
+
+logger = logging.getLogger(__name__)
+
+def _import_httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError("异步翻译引擎需要 'httpx' 库。\n请在终端运行 'pip install httpx' 来安装它 (如需HTTP/2, 请运行 'pip install \"httpx[http2]\"')。") from None
+    return httpx
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class AsyncTranslator(translator.Translator):
+    """Translator whose translate_batch is a coroutine, sending through one pooled httpx.AsyncClient.
+
+    Prompts, JSON/separator handling, batch splitting, retries, the circuit breaker and rate limits are the same as in
+    Translator, whose flow generators this class drives; only the transport differs, so hundreds of batches can be in
+    flight from one event loop without a thread each. Connections are kept alive in a pool of `pool_size` and use HTTP/2 when the h2 package is installed. The client
+    belongs to the event loop that first uses it; call aclose() (or use `async with`) before that loop ends."""
+
+    def __init__(self, *args, http2=None, keepalive_expiry=60.0, **kwargs):
+        self._httpx = _import_httpx()
+        super().__init__(*args, **kwargs)
+        # Translator's requests session holds the proxy and headers, but never sends anything here.
+        self.session.close()
+        httpx = self._httpx
+        self._status_errors = (httpx.HTTPStatusError,)
+        self._retryable_errors = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+        self._transport_errors = (httpx.HTTPError,)
+        self.http2 = _http2_available() if http2 is None else http2
+        self.keepalive_expiry = keepalive_expiry
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            httpx = self._httpx
+            self._client = httpx.AsyncClient(
+                headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"},
+                http2=self.http2,
+                proxy=self.proxy_url,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                    keepalive_expiry=self.keepalive_expiry),
+                # When streaming, the read timeout applies between chunks rather than to the whole reply.
+                timeout=httpx.Timeout(180, connect=30)
+            )
+            logger.info(f"异步翻译引擎已创建连接池: 最多 {self.pool_size} 个连接, HTTP/2: {'是' if self.http2 else '否'}")
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def translate_batch(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                              metrics: TranslationMetrics = None, on_segment=None, cancelled: threading.Event = None) -> list:
+        """Coroutine version of Translator.translate_batch with the same results, splitting and resending.
+
+        Besides setting `cancelled`, cancelling the task aborts the request on the wire at once."""
+        return await self._run(self._translate_flow(sources, prompt_template, source_language, target_language, metrics, on_segment, cancelled))
+
+    async def _run(self, flow):
+        outcome, error = None, None
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(outcome)
+            except StopIteration as stop:
+                return stop.value
+            outcome, error = None, None
+            try:
+                outcome = await self._perform(step)
+            except Exception as e:
+                error = e
+            except BaseException:
+                # Includes asyncio.CancelledError; the flow records the request as abandoned.
+                flow.close()
+                raise
+
+    async def _perform(self, step):
+        if step[0] == translator.STEP_SLEEP:
+            await self._sleep(*step[1:])
+            return None
+        return await self._send(*step[1:])
+
+    async def _send(self, body: bytes, count: int, on_segment, stats: RequestStats, cancelled: threading.Event = None):
+        client = self._get_client()
+        started = time.monotonic()
+        request = client.build_request("POST", self.api_url, content=body, headers=self.request_headers)
+        response = await client.send(request, stream=self.stream)
+        if self.stream:
+            try:
+                if response.is_error:
+                    # The error body is needed for the message and Retry-After details.
+                    await response.aread()
+                response.raise_for_status()
+                return await self._read_stream(response, count, on_segment, stats, started, cancelled)
+            finally:
+                await response.aclose()
+        stats.latency = time.monotonic() - started
+        response.raise_for_status()
+        response_data = response.json()
+        return self._parse_response(response_data), response_data.get('usage') or {}, {}
+
+    async def _sleep(self, delay: float, cancelled: threading.Event = None):
+        if cancelled is None:
+            await asyncio.sleep(delay)
+            return
+        deadline = time.monotonic() + delay
+        while not cancelled.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(min(0.1, deadline - time.monotonic()))
+
+    async def _read_stream(self, response, count: int, on_segment, stats: RequestStats, started: float, cancelled: threading.Event = None):
+        httpx = self._httpx
+        reader = translator.StreamReader(count, self.response_mode == translator.RESPONSE_MODE_JSON, on_segment, stats, started)
+        try:
+            async for line in response.aiter_lines():
+                if cancelled is not None and cancelled.is_set():
+                    raise translator.BatchCancelled()
+                if not reader.feed(line):
+                    break
+            if not reader.complete:
+                raise httpx.RemoteProtocolError("流式响应在结束标记之前中断")
+        except httpx.TransportError as e:
+            if not reader.found:
+                raise
+            logger.warning(f"流式响应中断 ({e})，保留已收到的 {len(reader.found)}/{count} 条译文。")
+        stats.latency = time.monotonic() - started
+        return reader.result()
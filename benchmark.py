@@ -0,0 +1,261 @@
+"""Offline benchmark for the batching pipeline.
+
+Starts a local mock of an OpenAI-compatible chat-completions endpoint in a separate process and runs
+pipeline.run_translation_job against seeded workbooks, so batching and concurrency changes can be
+measured without spending API quota. Example:
+
+    python benchmark.py --rows 1000 5000 --concurrency 1 4 8 --latency 0.3 --rate-limit-rate 0.02
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import openpyxl
+import translator
+import pipeline
+
+logger = logging.getLogger(__name__)
+
+_TEXT_MARKER = "--- TEXT TO TRANSLATE ---\n"
+_WORDS = ("order", "shipment", "invoice", "customer", "warehouse", "delivery", "payment", "status", "pending",
+          "confirmed", "returned", "damaged", "express", "standard", "priority", "discount", "total", "account")
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # Filled in by _serve: latency, jitter, rate_limit_rate, server_error_rate, straggler_rate, corruption_rate, stream_break_rate,
+    # seed, attempts, seen_prefixes.
+    options = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload, headers=()):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        options = self.options
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        request = json.loads(raw)
+        prompt = request["messages"][-1]["content"]
+        # Like DeepSeek's context cache, a system message seen before counts as cached prompt tokens.
+        instructions = "".join(m["content"] for m in request["messages"][:-1])
+        # Every decision is seeded by the request body and how often it was seen, so a run is
+        # reproducible regardless of the order concurrent batches arrive in.
+        digest = hashlib.sha256(raw).hexdigest()
+        attempt = options["attempts"].get(digest, 0)
+        options["attempts"][digest] = attempt + 1
+        rng = random.Random(f"{options['seed']}:{digest}:{attempt}")
+
+        time.sleep(max(0.0, options["latency"] + rng.uniform(-options["jitter"], options["jitter"])))
+        # Drawn from its own generator so enabling stragglers leaves every other decision of a seeded run unchanged.
+        if random.Random(f"{options['seed']}:{digest}:{attempt}:straggler").random() < options["straggler_rate"]:
+            time.sleep(options["latency"] * 10)
+        if rng.random() < options["rate_limit_rate"]:
+            self._reply(429, {"error": {
+                "code": 429, "message": "Resource has been exhausted (mock).",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}]
+            }}, headers=[("Retry-After", "1")])
+            return
+        if rng.random() < options["server_error_rate"]:
+            self._reply(503, {"error": {"code": 503, "message": "The model is overloaded (mock)."}})
+            return
+
+        text = prompt.split(_TEXT_MARKER)[-1]
+        corrupt = rng.random() < options["corruption_rate"]
+        if text.startswith("[{"):
+            # JSON response mode: corruption drops one id from the reply.
+            items = json.loads(text)
+            translations = {str(item["id"]): f"[译] {item['text']}" if item["text"].strip() else "" for item in items}
+            if corrupt and len(items) > 1:
+                del translations[str(rng.choice(items)["id"])]
+            content = json.dumps(translations, ensure_ascii=False)
+        else:
+            segments = text.split(translator.LINE_SEPARATOR)
+            content = translator.LINE_SEPARATOR.join(f"[译] {s}" if s.strip() else "" for s in segments)
+            if corrupt and len(segments) > 1:
+                content = content.replace(translator.LINE_SEPARATOR, "\n", 1)
+        usage = {"prompt_tokens": translator.estimate_tokens(instructions + prompt), "completion_tokens": translator.estimate_tokens(content),
+                 "prompt_cache_hit_tokens": translator.estimate_tokens(instructions) if instructions and instructions in options["seen_prefixes"] else 0}
+        options["seen_prefixes"].add(instructions)
+        if request.get("stream"):
+            self._stream(content, usage, rng)
+            return
+        self._reply(200, {
+            "id": f"mock-{digest[:12]}",
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _stream(self, content, usage, rng):
+        """Sends the reply as server-sent events in ~20-character deltas; with probability stream_break_rate the
+        connection is dropped halfway through."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [content[i:i + 20] for i in range(0, len(content), 20)] or [""]
+        cut = len(pieces) // 2 if rng.random() < self.options["stream_break_rate"] else None
+        for i, piece in enumerate(pieces):
+            if i == cut:
+                return
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b"\n\n")
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self.wfile.write(b"data: " + json.dumps(final).encode('utf-8') + b"\n\ndata: [DONE]\n\n")
+
+class _MockServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections when dozens of batches connect at once.
+    request_queue_size = 256
+
+def _serve(options, port_queue):
+    _MockHandler.options = dict(options, attempts={}, seen_prefixes=set())
+    server = _MockServer(("127.0.0.1", 0), _MockHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+class MockServer:
+    """Mock chat-completions endpoint running in its own process so it doesn't compete for the GIL
+    or show up in the client's memory measurement."""
+
+    def __init__(self, latency=0.2, jitter=0.05, rate_limit_rate=0.0, corruption_rate=0.0, stream_break_rate=0.0, seed=0, server_error_rate=0.0,
+                 straggler_rate=0.0):
+        self.options = {"latency": latency, "jitter": jitter, "rate_limit_rate": rate_limit_rate, "server_error_rate": server_error_rate,
+                        "straggler_rate": straggler_rate, "corruption_rate": corruption_rate, "stream_break_rate": stream_break_rate, "seed": seed}
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(self.options, port_queue), daemon=True)
+        self.process.start()
+        self.url = f"http://127.0.0.1:{port_queue.get(timeout=10)}/v1/chat/completions"
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+
+def make_workbook(file_path, rows, seed=0, duplicate_rate=0.2):
+    """Writes a workbook with `rows` source cells in column A; cell lengths vary from one word to a
+    short paragraph and about `duplicate_rate` of the cells repeat an earlier one."""
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.cell(row=1, column=1, value="Source")
+    sheet.cell(row=1, column=2, value="Target")
+    written = []
+    for r in range(2, rows + 2):
+        if written and rng.random() < duplicate_rate:
+            text = rng.choice(written)
+        else:
+            length = rng.choice((1, 3, 8, 20, 60))
+            text = f"{r} " + " ".join(rng.choice(_WORDS) for _ in range(length))
+            written.append(text)
+        sheet.cell(row=r, column=1, value=text)
+    workbook.save(file_path)
+
+def run_scenario(server_url, rows, concurrency, seed=0, batch_token_budget=None, response_mode=translator.RESPONSE_MODE_SEPARATOR, stream=False,
+                 hedge=False, use_async=False, compress=False):
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = os.path.join(work_dir, f"bench_{rows}.xlsx")
+        make_workbook(file_path, rows, seed)
+        client = pipeline.create_translator({
+            "api_key": "benchmark",
+            "model_id": "mock-model",
+            "provider": "Custom",
+            "api_url": server_url,
+            "batch_token_budget": batch_token_budget,
+            "response_mode": response_mode,
+            "stream": stream,
+            "compress_requests": compress
+        }, pool_size=concurrency, use_async=use_async)
+        runner = pipeline.create_hedged_translator(client, max_concurrency=concurrency) if hedge else client
+        job = pipeline.TranslationJob(file_path, "A", "B", 2, "English", "Chinese", translator.DEFAULT_PROMPT_TEMPLATE)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            pipeline.run_translation_job(job, runner, concurrency, export_report=False)
+            elapsed = time.perf_counter() - started
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            if hedge:
+                runner.close()
+
+    summary = client.metrics.summary()
+    return {
+        "rows": rows,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(job.total_rows / elapsed, 1) if elapsed > 0 else 0.0,
+        "requests": summary["requests"],
+        "retries": summary["retries"],
+        "tokens": summary["prompt_tokens"] + summary["completion_tokens"],
+        "cached_tokens": summary["cached_prompt_tokens"],
+        "mismatches": summary["mismatches"],
+        "failed_rows": job.failed_rows,
+        "latency_p50": summary["latency_p50"],
+        "latency_p99": summary["latency_p99"],
+        "peak_memory_mb": round(peak_memory / (1 << 20), 2),
+    }
+
+_COLUMNS = ("rows", "concurrency", "elapsed_seconds", "rows_per_second", "requests", "retries", "tokens", "cached_tokens", "mismatches",
+            "failed_rows", "latency_p50", "latency_p99", "peak_memory_mb")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the translation pipeline against a local mock API.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000], help="Row counts to benchmark.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Concurrency levels to benchmark.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean mock response latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform +/- jitter added to the latency, in seconds.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--straggler-rate", type=float, default=0.0, help="Fraction of requests that take ten times the mean latency.")
+    parser.add_argument("--corruption-rate", type=float, default=0.0, help="Fraction of responses with one separator (or JSON id) dropped.")
+    parser.add_argument("--stream", action="store_true", help="Request streamed (SSE) replies.")
+    parser.add_argument("--stream-break-rate", type=float, default=0.0, help="Fraction of streamed replies cut off halfway.")
+    parser.add_argument("--response-mode", choices=[translator.RESPONSE_MODE_SEPARATOR, translator.RESPONSE_MODE_JSON], default=translator.RESPONSE_MODE_SEPARATOR)
+    parser.add_argument("--hedge", action="store_true", help="Duplicate batches that run past the observed p95 latency.")
+    parser.add_argument("--async-engine", action="store_true", help="Use the httpx-based AsyncTranslator (requires httpx).")
+    parser.add_argument("--compress", action="store_true", help="Gzip request bodies.")
+    parser.add_argument("--batch-token-budget", type=int, default=None, help="Initial token budget per batch.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    results = []
+    with MockServer(args.latency, args.jitter, args.rate_limit_rate, args.corruption_rate, args.stream_break_rate, args.seed,
+                    args.server_error_rate, args.straggler_rate) as server:
+        print(" ".join(f"{c:>15}" for c in _COLUMNS))
+        for rows in args.rows:
+            for concurrency in args.concurrency:
+                result = run_scenario(server.url, rows, concurrency, args.seed, args.batch_token_budget, args.response_mode, args.stream,
+                                      args.hedge, args.async_engine, args.compress)
+                results.append(result)
+                print(" ".join(f"{result[c]:>15}" for c in _COLUMNS), flush=True)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "results": results}, f, ensure_ascii=False, indent=4)
+
+if __name__ == "__main__":
+    main()
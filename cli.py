@@ -0,0 +1,184 @@
+"""Command-line entry point that runs translation jobs without the Tk GUI.
+
+Models, proxies, languages, columns and the prompt default to what the GUI saved in config.json; any of
+them can be overridden per run. Example:
+
+    python cli.py data/a.xlsx data/b.xlsx --sheet Sheet1 --src-col B --tgt-col C --start-row 2 --target-language 英语
+    python cli.py data/ --all-sheets --concurrency 8
+    python cli.py book.xlsx --src-col B --target C=英语 --target D=日语 --target E=法语
+    python cli.py data/ --model Gemini --model DeepSeek --concurrency 8
+    python cli.py data/ --async-engine --concurrency 128
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import excel_io
+import pipeline
+import translation_memory
+
+logger = logging.getLogger(__name__)
+
+def load_config(file_path: str) -> dict:
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SystemExit(f"未找到配置文件: {file_path}。请先在图形界面中配置模型，或通过 --config 指定配置文件。")
+    except json.JSONDecodeError as e:
+        raise SystemExit(f"配置文件格式错误: {file_path}: {e}")
+
+def expand_files(paths) -> list:
+    """Folders expand to the .xlsx files directly inside them, skipping Excel's ~$ lock files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(".xlsx") and not name.startswith("~$")
+            ))
+        else:
+            files.append(path)
+    return files
+
+def setup_logging(verbose: bool):
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if verbose else logging.INFO)
+    handler = logging.StreamHandler(io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Translate an Excel column with the configured AI model, without the GUI.")
+    parser.add_argument("files", nargs="+", help="Workbooks, or folders of .xlsx files, to translate through one shared worker pool.")
+    parser.add_argument("--config", default="config.json", help="Configuration file saved by the GUI (default: config.json).")
+    parser.add_argument("--model", action="append",
+                        help="Model configuration name (default: the one last selected in the GUI); repeat to spread batches over a pool of models.")
+    parser.add_argument("--proxy", help="Proxy configuration name, or 无代理 (default: the one last selected in the GUI).")
+    sheets = parser.add_mutually_exclusive_group()
+    sheets.add_argument("--sheet", action="append", help="Worksheet name; may be repeated (default: the active sheet).")
+    sheets.add_argument("--all-sheets", action="store_true", help="Translate every worksheet of every workbook.")
+    parser.add_argument("--src-col", help="Source column letter, e.g. B.")
+    parser.add_argument("--tgt-col", help="Target column letter, e.g. C.")
+    parser.add_argument("--start-row", type=int, help="First row to translate.")
+    parser.add_argument("--source-language")
+    parser.add_argument("--target-language")
+    parser.add_argument("--target", action="append", metavar="COL=LANGUAGE",
+                        help="Target column and language, e.g. C=英语; repeat to translate into several languages in one pass.")
+    parser.add_argument("--prompt-file", help="Read the prompt template from this file instead of the configuration.")
+    parser.add_argument("--concurrency", type=int, help="Batches in flight at once (1-32, or 1-256 with --async-engine).")
+    parser.add_argument("--async-engine", action="store_true",
+                        help="Send batches from one asyncio event loop through httpx instead of a thread each (requires httpx).")
+    parser.add_argument("--hedge", action="store_true", help="Duplicate batches that run past the observed p95 latency; the first reply wins.")
+    parser.add_argument("--hedge-model", help="Model configuration name to send the duplicates to (implies --hedge; default: the same model).")
+    parser.add_argument("--no-memory", action="store_true", help="Don't read or write the translation memory.")
+    parser.add_argument("--verbose", action="store_true", help="Also log debug messages.")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logging(args.verbose)
+    config = load_config(args.config)
+
+    models = config.get("models", {})
+    model_names = args.model or [config.get("current_model_name", "")]
+    for model_name in model_names:
+        if model_name not in models:
+            raise SystemExit(f"未找到模型配置 '{model_name}'。可用的配置: {', '.join(models) or '无'}")
+    proxy_name = args.proxy or config.get("current_proxy_name", "无代理")
+    proxy_config = None
+    if proxy_name != "无代理":
+        if proxy_name not in config.get("proxies", {}):
+            raise SystemExit(f"未找到代理配置 '{proxy_name}'。")
+        proxy_config = config["proxies"][proxy_name]
+
+    try:
+        targets = pipeline.parse_targets(",".join(args.target or []))
+        if not targets:
+            targets = [((args.tgt_col or config.get("tgt_col", "")).upper(), args.target_language or config.get("target_language", "简体中文"))]
+            if not args.tgt_col and not args.target_language:
+                targets += pipeline.parse_targets(config.get("extra_targets", ""))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    (tgt_col, target_language), extra_targets = targets[0], targets[1:]
+    src_col = (args.src_col or config.get("src_col", "")).upper()
+    start_row = args.start_row or config.get("src_row")
+    if not src_col or not tgt_col or not start_row:
+        raise SystemExit("请通过 --src-col、--tgt-col (或 --target) 和 --start-row 指定源语言列、目标语言列和起始行。")
+    source_language = args.source_language or config.get("source_language", "俄语")
+    if args.prompt_file:
+        with open(args.prompt_file, 'r', encoding='utf-8') as f:
+            prompt_template = pipeline.normalize_prompt_template(f.read())
+    else:
+        prompt_template = pipeline.normalize_prompt_template(config.get("prompt_template", ""))
+    hedge_model = args.hedge_model or config.get("hedge_model")
+    hedge = args.hedge or args.hedge_model or config.get("hedge_requests")
+    use_async = args.async_engine or (len(model_names) == 1 and models[model_names[0]].get("async_engine", False))
+    if args.async_engine and (len(model_names) > 1 or args.hedge or args.hedge_model):
+        raise SystemExit("--async-engine 不能与模型池或对冲请求同时使用。")
+    if use_async and hedge:
+        logger.warning("对冲请求需要同步翻译引擎，本次运行不使用异步引擎。")
+        use_async = False
+    try:
+        # Async batches are coroutines rather than threads, so far more of them can wait on the network at once.
+        max_concurrency = min(max(int(args.concurrency or config.get("max_concurrency", 3)), 1), 256 if use_async else 32)
+    except (ValueError, TypeError):
+        max_concurrency = 1
+
+    memory = None
+    if not args.no_memory and config.get("use_translation_memory", True):
+        memory = translation_memory.TranslationMemory(max_entries=config.get("translation_memory_max_entries", translation_memory.DEFAULT_MAX_ENTRIES))
+
+    jobs = []
+    for file_path in expand_files(args.files):
+        try:
+            sheet_names = excel_io.list_sheets(file_path) if args.all_sheets else (args.sheet or [None])
+        except Exception as e:
+            raise SystemExit(f"无法打开Excel文件 {file_path}: {e}")
+        for sheet_name in sheet_names:
+            try:
+                jobs.append(pipeline.TranslationJob(
+                    file_path, src_col, tgt_col, start_row, source_language, target_language, prompt_template,
+                    sheet_name=sheet_name, extra_targets=extra_targets
+                ))
+            except ValueError as e:
+                raise SystemExit(str(e))
+    if not jobs:
+        raise SystemExit("没有找到需要翻译的Excel文件。")
+
+    if len(model_names) > 1:
+        client = pipeline.create_translator_pool(models, model_names, proxy_config, pool_size=max_concurrency)
+    else:
+        try:
+            client = pipeline.create_translator(models[model_names[0]], proxy_config, pool_size=max_concurrency, use_async=use_async)
+        except ImportError as e:
+            raise SystemExit(str(e))
+    if hedge:
+        if hedge_model and hedge_model not in models:
+            raise SystemExit(f"未找到对冲模型配置 '{hedge_model}'。")
+        secondary = pipeline.create_translator(models[hedge_model], proxy_config, pool_size=max_concurrency, use_async=False) if hedge_model else None
+        client = pipeline.create_hedged_translator(client, secondary, max_concurrency)
+    try:
+        pipeline.run_translation_queue(
+            jobs, client, max_concurrency, memory=memory,
+            on_progress=lambda job: logger.info(f"{os.path.basename(job.file_path)} [{job.sheet_title}] {job.progress.describe()}")
+        )
+    finally:
+        if hedge:
+            client.close()
+        if memory:
+            memory.close()
+
+    exit_code = 0
+    for job in jobs:
+        if job.error:
+            exit_code = 1
+        elif job.failed_rows:
+            logger.warning(f"{job.file_path} [{job.sheet_title}]: {job.failed_rows} 行翻译失败。")
+            exit_code = 1
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
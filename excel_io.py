@@ -0,0 +1,201 @@
+import logging
+import os
+import posixpath
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+import openpyxl
+from openpyxl.utils.cell import range_boundaries
+
+logger = logging.getLogger(__name__)
+
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_MERGE_CELL_PATTERN = re.compile(rb'<(?:\w+:)?mergeCell\s[^>]*?ref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"')
+
+def read_column(file_path: str, col_idx: int, start_row: int, sheet_name: str = None):
+    """Streams one column from `start_row` down without building the rest of the workbook in memory.
+
+    Returns (sheet title, list of cell values)."""
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.active
+        # The stored dimension is often stale; without this rows past it would be silently skipped.
+        sheet.reset_dimensions()
+        values = [row[0] for row in sheet.iter_rows(min_row=start_row, min_col=col_idx, max_col=col_idx, values_only=True)]
+        logger.debug(f"已流式读取工作表 '{sheet.title}' 第 {col_idx} 列的 {len(values)} 行。")
+        return sheet.title, values
+    finally:
+        workbook.close()
+
+def list_sheets(file_path: str) -> list:
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+def write_columns(file_path: str, sheet_name: str, columns: dict):
+    """Writes {col_idx: {row: value}} and saves once. openpyxl cannot edit in read-only mode,
+    so the workbook is loaded in full here, but only for the duration of the save."""
+    workbook = openpyxl.load_workbook(file_path)
+    try:
+        sheet = workbook[sheet_name]
+        for col_idx, results in columns.items():
+            for row, value in results.items():
+                sheet.cell(row=row, column=col_idx).value = value
+        workbook.save(file_path)
+    finally:
+        workbook.close()
+
+def _resolve_part(base_dir, target):
+    return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base_dir, target))
+
+def _find_sheet_part(archive, sheet_title):
+    root_rels = ET.fromstring(archive.read("_rels/.rels"))
+    workbook_part = next(
+        (_resolve_part("", rel.get("Target")) for rel in root_rels.iter(f"{_PKG_REL_NS}Relationship") if rel.get("Type", "").endswith("/officeDocument")),
+        "xl/workbook.xml"
+    )
+    base_dir, name = posixpath.split(workbook_part)
+    workbook_rels = ET.fromstring(archive.read(posixpath.join(base_dir, "_rels", name + ".rels")))
+    targets = {rel.get("Id"): rel.get("Target") for rel in workbook_rels.iter(f"{_PKG_REL_NS}Relationship")}
+    for sheet in ET.fromstring(archive.read(workbook_part)).iter(f"{_MAIN_NS}sheet"):
+        if sheet.get("name") == sheet_title:
+            return _resolve_part(base_dir, targets[sheet.get(f"{_REL_NS}id")])
+    raise KeyError(sheet_title)
+
+def read_merged_ranges(file_path: str, sheet_title: str) -> list:
+    """Returns merged ranges as (min_row, min_col, max_row, max_col).
+
+    Read-only worksheets don't expose merged cells, so the sheet XML is scanned for <mergeCell>
+    entries directly; a byte scan is much cheaper than a second XML parse of a huge sheet."""
+    ranges = []
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open(_find_sheet_part(archive, sheet_title)) as src:
+            tail = b""
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                data = tail + chunk
+                last_end = 0
+                for match in _MERGE_CELL_PATTERN.finditer(data):
+                    min_col, min_row, max_col, max_row = range_boundaries(match.group(1).decode())
+                    ranges.append((min_row, min_col, max_row, max_col))
+                    last_end = match.end()
+                # Keep the end of the chunk in case a tag is split across reads.
+                tail = data[max(last_end, len(data) - 256):]
+    return ranges
+
+class SheetPreviewData:
+    """Cell values of the active worksheet, parsed on a background thread in read-only mode.
+
+    Only the first `initial_rows` rows are read up front; the parser then pauses until
+    request_rows asks for more, so huge sheets open immediately and load as they are scrolled.
+    `on_update(data)` is called from the loader thread whenever new rows or merged ranges arrive.
+    close() stops the loader and releases the workbook; `complete` is set once every row has been read."""
+
+    def __init__(self, file_path, on_update=None, initial_rows=300, chunk_rows=500):
+        self.file_path = file_path
+        self.mtime = os.path.getmtime(file_path)
+        self.title = None
+        self.rows = []
+        self.declared_rows = 0
+        self.max_column = 0
+        self.merged_ranges = []
+        self.finished = False
+        self.complete = False
+        self.error = None
+        self.chunk_rows = chunk_rows
+        self._on_update = on_update
+        self._wanted_rows = initial_rows
+        self._closed = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._load, daemon=True).start()
+
+    @property
+    def max_row(self):
+        return max(len(self.rows), self.declared_rows)
+
+    def value(self, row, col):
+        if row <= len(self.rows):
+            values = self.rows[row - 1]
+            if col <= len(values):
+                return values[col - 1]
+        return None
+
+    def request_rows(self, count):
+        with self._cond:
+            if count > self._wanted_rows:
+                self._wanted_rows = count
+                self._cond.notify_all()
+
+    def close(self):
+        """Stops a loader still paused or parsing; the rows read so far stay available."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def matches(self, file_path) -> bool:
+        """True if this data is still current for `file_path`, i.e. the file hasn't been modified since."""
+        try:
+            return self.error is None and os.path.samefile(file_path, self.file_path) and os.path.getmtime(file_path) == self.mtime
+        except OSError:
+            return False
+
+    def column_values(self, col_idx, start_row) -> list:
+        """One column of the rows read so far; the whole column only once `complete` is set."""
+        return [values[col_idx - 1] if col_idx <= len(values) else None for values in self.rows[start_row - 1:]]
+
+    def _notify(self):
+        if self._on_update:
+            self._on_update(self)
+
+    def _load(self):
+        try:
+            workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+            try:
+                sheet = workbook.active
+                self.title = sheet.title
+                self.declared_rows = sheet.max_row or 0
+                self.max_column = sheet.max_column or 0
+                sheet.reset_dimensions()
+                threading.Thread(target=self._load_merged_ranges, daemon=True).start()
+                for values in sheet.iter_rows(values_only=True):
+                    if len(self.rows) >= self._wanted_rows:
+                        # Notify outside the lock: the UI thread may be blocked in request_rows.
+                        self._notify()
+                        with self._cond:
+                            self._cond.wait_for(lambda: len(self.rows) < self._wanted_rows or self._closed)
+                    if self._closed:
+                        logger.debug(f"已停止后台加载: {self.file_path}")
+                        break
+                    self.rows.append(values)
+                    if len(values) > self.max_column:
+                        self.max_column = len(values)
+                    if len(self.rows) % self.chunk_rows == 0:
+                        self._notify()
+                else:
+                    self.complete = True
+            finally:
+                workbook.close()
+        except Exception as e:
+            logger.error(f"后台加载Excel文件失败: {e}")
+            self.error = e
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+        self._notify()
+
+    def _load_merged_ranges(self):
+        try:
+            merged_ranges = read_merged_ranges(self.file_path, self.title)
+        except Exception as e:
+            logger.debug(f"读取合并单元格信息失败，预览将不处理合并单元格: {e}")
+            return
+        if merged_ranges:
+            self.merged_ranges = merged_ranges
+            self._notify()
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import translator
+from metrics import TranslationMetrics, percentile
+
+logger = logging.getLogger(__name__)
+
+def _error_count(translations) -> int:
+    return sum(translator.is_error_result(t) for t in translations)
+
+class HedgedTranslator:
+    """Sends a duplicate of any batch still running after the observed p95 latency and keeps whichever reply completes first.
+
+    The duplicate goes to `secondary` if given, otherwise to `primary` again; once one reply comes back without errors the
+    other request is cancelled. Until `min_samples` batches have succeeded there is no latency to go by and nothing is
+    hedged, and at most `max_hedge_ratio` of the batches are duplicated, so a slowdown of the whole endpoint doesn't double
+    the load on it. Stands in for a Translator (or TranslatorPool) in pipeline.run_translation_queue; call close() once the
+    run is over."""
+
+    def __init__(self, primary, secondary=None, quantile=0.95, min_samples=20, min_delay=1.0, max_hedge_ratio=0.1,
+                 window=200, max_workers=64):
+        self.primary = primary
+        self.secondary = secondary or primary
+        # Either model may produce a stored translation, so translation memory keys them by both, as TranslatorPool does.
+        self.model_id = "+".join(sorted({primary.model_id, self.secondary.model_id}))
+        self.batch_sizer = primary.batch_sizer
+        self.metrics = primary.metrics
+        self.secondary.metrics = primary.metrics
+        self.streams_segments = primary.streams_segments or self.secondary.streams_segments
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_hedge_ratio = max_hedge_ratio
+        self.batches = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        # Each batch occupies up to two of these threads while the caller's thread waits on them.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def close(self):
+        """Stops the worker threads; requests still running are left to finish on their own."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def hedge_delay(self):
+        """Seconds after which a batch is duplicated, or None while there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return max(percentile(self._latencies, self.quantile), self.min_delay)
+
+    def _observe(self, future, started):
+        # The loser counts too when it finishes uncancelled: it is exactly the tail this percentile has to see.
+        try:
+            translations = future.result()
+        except Exception:
+            return
+        if not _error_count(translations):
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges >= max(1, self.max_hedge_ratio * self.batches):
+                return False
+            self.hedges += 1
+            return True
+
+    def translate_batch(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                        metrics: TranslationMetrics = None, on_segment=None) -> list:
+        """Same contract as Translator.translate_batch."""
+        if not sources:
+            return []
+        with self._lock:
+            self.batches += 1
+        decided = threading.Event()
+        segment_lock = threading.Lock()
+
+        def forward(index, translation):
+            # Both requests may stream; segments stop being forwarded once the batch has its result.
+            with segment_lock:
+                if not decided.is_set():
+                    on_segment(index, translation)
+
+        attempts = {}
+
+        def launch(client):
+            cancelled = threading.Event()
+            started = time.monotonic()
+            future = self._executor.submit(client.translate_batch, sources, prompt_template, source_language, target_language,
+                                           metrics, forward if on_segment else None, cancelled)
+            attempts[future] = cancelled
+            future.add_done_callback(lambda f: self._observe(f, started))
+            return future
+
+        primary = launch(self.primary)
+        hedge = None
+        delay = self.hedge_delay()
+        if delay is not None and not wait([primary], timeout=delay).done and self._may_hedge():
+            logger.info(f"批次 ({len(sources)} 行) 已超过 {delay:.1f} 秒未返回，向 {self.secondary.model_id} 发送对冲请求。")
+            hedge = launch(self.secondary)
+
+        best, best_future, error = None, None, None
+        pending = set(attempts)
+        while pending and (best is None or _error_count(best)):
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    translations = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if best is None or _error_count(translations) < _error_count(best):
+                    best, best_future = translations, future
+        with segment_lock:
+            decided.set()
+        for future, cancelled in attempts.items():
+            if future is not best_future:
+                cancelled.set()
+        if best is None:
+            raise error
+        if hedge is not None and best_future is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+            logger.info(f"对冲请求先于原请求返回 (累计 {self.hedge_wins}/{self.hedges} 次)。")
+        return best
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".journal.sqlite3"
+
+# Several jobs (one per sheet) can share a workbook's journal; the file is only removed once the last one lets go.
+_open_lock = threading.Lock()
+_open_counts = {}
+
+def make_job_key(file_path: str, sheet_name: str, src_col: str, tgt_col: str, start_row: int, source_language: str, target_language: str) -> str:
+    raw = json.dumps([os.path.abspath(file_path), sheet_name, src_col, tgt_col, start_row, source_language, target_language], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class JobJournal:
+    """Append-only record of finished rows kept next to the workbook until the job saves successfully."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._closed = False
+        with _open_lock:
+            _open_counts[os.path.abspath(db_path)] = _open_counts.get(os.path.abspath(db_path), 0) + 1
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " job_key TEXT NOT NULL,"
+                " row INTEGER NOT NULL,"
+                " translation TEXT NOT NULL,"
+                " PRIMARY KEY (job_key, row))"
+            )
+
+    @classmethod
+    def for_workbook(cls, file_path):
+        return cls(file_path + JOURNAL_SUFFIX)
+
+    def load(self, job_key) -> dict:
+        """Returns {row: translation} for every row this job already finished."""
+        with self._lock:
+            rows = self._conn.execute("SELECT row, translation FROM rows WHERE job_key = ?", (job_key,)).fetchall()
+        return dict(rows)
+
+    def record(self, job_key, results):
+        """Commits (row, translation) pairs; called once per finished batch."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", [(job_key, row, text) for row, text in results])
+
+    def finish(self, *job_keys):
+        """Drops the jobs' rows, closes the journal and removes the file once no job is left in it."""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("DELETE FROM rows WHERE job_key = ?", [(job_key,) for job_key in job_keys])
+            remaining = self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        with _open_lock:
+            last = self._release()
+            if last and not remaining:
+                try:
+                    os.remove(self.db_path)
+                except OSError as e:
+                    logger.warning(f"删除断点记录文件失败: {e}")
+
+    def close(self):
+        with _open_lock:
+            self._release()
+
+    def _release(self) -> bool:
+        """Closes the connection; True if no other JobJournal has this file open. Caller holds _open_lock."""
+        with self._lock:
+            if self._closed:
+                return False
+            self._closed = True
+            self._conn.close()
+        key = os.path.abspath(self.db_path)
+        _open_counts[key] -= 1
+        if _open_counts[key]:
+            return False
+        del _open_counts[key]
+        return True
@@ -0,0 +1,119 @@
+import csv
+import dataclasses
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+@dataclasses.dataclass
+class RequestStats:
+    """What one translate request cost, including its retries."""
+    model_id: str = ""
+    segments: int = 0
+    payload_bytes: int = 0
+    status: str = "pending"
+    latency: float = 0.0
+    first_token_latency: float = 0.0
+    queue_wait: float = 0.0
+    rate_limit_wait: float = 0.0
+    backoff_wait: float = 0.0
+    retries: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    mismatched: bool = False
+    finished_at: float = 0.0
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class TranslationMetrics:
+    """Thread-safe collection of RequestStats for one Translator."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, stats: RequestStats):
+        stats.finished_at = time.time()
+        with self._lock:
+            self.records.append(stats)
+
+    def latencies(self):
+        with self._lock:
+            return [r.latency for r in self.records if r.status == "ok"]
+
+    def summary(self) -> dict:
+        with self._lock:
+            records = list(self.records)
+        latencies = [r.latency for r in records if r.status == "ok"]
+        prompt_tokens = sum(r.prompt_tokens for r in records)
+        cached_tokens = sum(r.cached_tokens for r in records)
+        return {
+            "requests": len(records),
+            "failed_requests": sum(r.status not in ("ok", "mismatch", "partial", "cancelled") for r in records),
+            "cancelled_requests": sum(r.status == "cancelled" for r in records),
+            "segments": sum(r.segments for r in records),
+            "mismatches": sum(r.mismatched for r in records),
+            "retries": sum(r.retries for r in records),
+            "queue_wait_seconds": round(sum(r.queue_wait for r in records), 3),
+            "rate_limit_wait_seconds": round(sum(r.rate_limit_wait for r in records), 3),
+            "backoff_wait_seconds": round(sum(r.backoff_wait for r in records), 3),
+            "payload_bytes": sum(r.payload_bytes for r in records),
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": cached_tokens,
+            "prompt_cache_hit_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+            "completion_tokens": sum(r.completion_tokens for r in records),
+            "latency_p50": round(percentile(latencies, 0.5), 3),
+            "latency_p95": round(percentile(latencies, 0.95), 3),
+            "latency_p99": round(percentile(latencies, 0.99), 3),
+            "latency_max": round(max(latencies, default=0.0), 3),
+            "first_token_latency_p50": round(percentile([r.first_token_latency for r in records if r.first_token_latency], 0.5), 3),
+        }
+
+    def export(self, base_path: str, job_info: dict = None):
+        """Writes `<base_path>.report.json` (job info, summary and every request) and `<base_path>.report.csv` (one row per request)."""
+        with self._lock:
+            records = [dataclasses.asdict(r) for r in self.records]
+        report = {"job": job_info or {}, "summary": self.summary(), "requests": records}
+        with open(base_path + ".report.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        with open(base_path + ".report.csv", "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[field.name for field in dataclasses.fields(RequestStats)])
+            writer.writeheader()
+            writer.writerows(records)
+        logger.info(f"翻译统计报告已导出: {base_path}.report.json / .report.csv")
+
+class JobProgress:
+    """Rows/sec and ETA for a running job."""
+
+    def __init__(self, total_rows: int):
+        self.total_rows = total_rows
+        self.done_rows = 0
+        self.started_at = time.monotonic()
+
+    def advance(self, rows: int):
+        self.done_rows += rows
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.done_rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.rows_per_second
+        return (self.total_rows - self.done_rows) / rate if rate > 0 else None
+
+    def describe(self) -> str:
+        eta = self.eta
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta is not None else "--:--:--"
+        return f"进度: {self.done_rows}/{self.total_rows} 行, {self.rows_per_second:.1f} 行/秒, 预计剩余 {eta_text}"
@@ -0,0 +1,130 @@
+import logging
+import random
+import threading
+import time
+import translator
+from metrics import TranslationMetrics
+
+logger = logging.getLogger(__name__)
+
+# Results that say the endpoint itself failed, as opposed to the model garbling a batch.
+_ENDPOINT_ERROR_MARKERS = ("[HTTP错误", "[网络错误", "[API响应格式错误", "[未知错误", "[批量翻译失败", "[接口熔断")
+
+class _Member:
+    def __init__(self, client):
+        self.client = client
+        self.throughput = None  # EWMA of segments per second
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def available_at(self) -> float:
+        return max(self.cooldown_until, self.client.blocked_until)
+
+class TranslatorPool:
+    """Spreads batches over several Translators, weighted by observed throughput and remaining quota.
+
+    Stands in for a single Translator in pipeline.run_translation_queue. A batch whose endpoint answers
+    only with errors (rate limit, HTTP or network failure) is rerouted to the next member, and the failing
+    member sits out a cooldown: as long as a 429 asked for, otherwise `cooldown` seconds, doubling each time
+    it fails again after a cooldown has run out."""
+
+    def __init__(self, clients, cooldown=30.0, max_cooldown=300.0, smoothing=0.3, rounds=3):
+        if not clients:
+            raise ValueError("模型池中至少需要一个模型。")
+        self.members = [_Member(client) for client in clients]
+        self.model_id = "+".join(sorted(client.model_id for client in clients))
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self.rounds = max(int(rounds), 1)
+        # Batches are cut before a member is picked, so they are sized for the most constrained one.
+        self.batch_sizer = min((client.batch_sizer for client in clients), key=lambda sizer: sizer.token_budget)
+        self.metrics = TranslationMetrics()
+        self.streams_segments = any(client.streams_segments for client in clients)
+        for client in clients:
+            client.batch_sizer = self.batch_sizer
+            client.metrics = self.metrics
+            # Waiting out a long 429 on one endpoint is pointless while another one is free.
+            client.max_rate_limit_wait = 0
+            # Likewise for retrying a failing endpoint: one quick retry, then the batch moves on.
+            policy = client.retry_policy
+            client.retry_policy = translator.RetryPolicy(min(policy.max_attempts, 2), policy.base_delay, policy.max_delay)
+        self._lock = threading.Lock()
+
+    def _weight(self, member, fallback_throughput):
+        headroom = member.client.rate_limiter.headroom() if member.client.rate_limiter else 1.0
+        throughput = member.throughput if member.throughput is not None else fallback_throughput
+        return throughput * max(headroom, 0.05) / (1 + member.in_flight)
+
+    def _pick(self, tried):
+        """Returns an untried member that isn't cooling down, waiting for one if necessary; None once all were tried."""
+        while True:
+            with self._lock:
+                candidates = [m for m in self.members if m not in tried]
+                if not candidates:
+                    return None
+                now = time.monotonic()
+                ready = [m for m in candidates if m.available_at() <= now]
+                if ready:
+                    # Members with no history yet get the best known throughput so they are tried early.
+                    fallback = max((m.throughput for m in self.members if m.throughput is not None), default=1.0)
+                    weights = [self._weight(m, fallback) for m in ready]
+                    member = random.choices(ready, weights)[0]
+                    member.in_flight += 1
+                    return member
+                delay = min(m.available_at() for m in candidates) - now
+            logger.info(f"模型池中的模型均在冷却中，等待 {delay:.1f} 秒...")
+            time.sleep(delay)
+
+    def _record(self, member, started, segments, failed, endpoint_failed):
+        now = time.monotonic()
+        with self._lock:
+            member.in_flight -= 1
+            if endpoint_failed:
+                if member.client.blocked_until > started:
+                    # A 429 or the circuit breaker said when to come back; that beats any guess.
+                    member.cooldown_until = max(member.cooldown_until, member.client.blocked_until)
+                elif now >= member.cooldown_until:
+                    # Batches that were in flight together fail together; only a failure after the cooldown escalates it.
+                    member.failures += 1
+                    member.cooldown_until = now + min(self.cooldown * 2 ** (member.failures - 1), self.max_cooldown)
+            elif not failed:
+                elapsed = now - started
+                member.failures = 0
+                sample = segments / elapsed if elapsed > 0 else segments
+                member.throughput = sample if member.throughput is None else \
+                    self.smoothing * sample + (1 - self.smoothing) * member.throughput
+
+    def translate_batch(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                        metrics: TranslationMetrics = None, on_segment=None, cancelled: threading.Event = None) -> list:
+        """Same contract as Translator.translate_batch; tries each member at most once per round, for up to `rounds` rounds
+        while the failures are the endpoints' own."""
+        tried = set()
+        translations = None
+        endpoint_failed = False
+        round_number = 1
+        while True:
+            member = self._pick(tried)
+            if member is None:
+                if not endpoint_failed or round_number >= self.rounds:
+                    return translations
+                # Every member failed this batch; the next round waits for the first cooldown to run out.
+                round_number += 1
+                tried.clear()
+                logger.warning(f"模型池中的所有模型均未能翻译该批次，第 {round_number}/{self.rounds} 轮重试。")
+                continue
+            tried.add(member)
+            started = time.monotonic()
+            try:
+                translations = member.client.translate_batch(sources, prompt_template, source_language, target_language, metrics, on_segment, cancelled)
+            except Exception:
+                self._record(member, started, len(sources), True, True)
+                raise
+            failed = all(translator.is_error_result(t) for t in translations)
+            endpoint_failed = failed and any(t.startswith(_ENDPOINT_ERROR_MARKERS) for t in translations)
+            self._record(member, started, len(sources), failed, endpoint_failed)
+            if not failed or (cancelled is not None and cancelled.is_set()):
+                return translations
+            if len(tried) < len(self.members):
+                logger.warning(f"模型 {member.client.model_id} 翻译失败 ({translations[0]})，改由模型池中的其他模型重试该批次。")
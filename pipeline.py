@@ -0,0 +1,447 @@
+import asyncio
+import contextlib
+import logging
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openpyxl.utils import column_index_from_string
+import translator
+import job_journal
+import excel_io
+import metrics
+import model_pool
+import hedging
+import async_translator
+
+logger = logging.getLogger(__name__)
+
+def create_translator(model_details: dict, proxy_config: dict = None, pool_size: int = 1, use_async: bool = None):
+    """Builds a Translator from one entry of the `models` section of config.json.
+
+    With "async_engine" set in the entry, or use_async=True, an AsyncTranslator is built instead (requires httpx)."""
+    use_async = model_details.get("async_engine", False) if use_async is None else use_async
+    engine = async_translator.AsyncTranslator if use_async else translator.Translator
+    return engine(
+        api_key=model_details.get("api_key"),
+        model_id=model_details.get("model_id"),
+        api_provider=model_details.get("provider"),
+        custom_api_url=model_details.get("api_url"),
+        proxy_config=proxy_config,
+        pool_size=pool_size,
+        requests_per_minute=model_details.get("requests_per_minute"),
+        tokens_per_minute=model_details.get("tokens_per_minute"),
+        chars_per_token=model_details.get("chars_per_token"),
+        batch_token_budget=model_details.get("batch_token_budget"),
+        response_mode=model_details.get("response_mode"),
+        use_response_format=model_details.get("response_format"),
+        stream=model_details.get("stream", False),
+        retry_policy=translator.RetryPolicy(model_details["max_retries"] + 1) if model_details.get("max_retries") is not None else None,
+        compress_requests=model_details.get("compress_requests", False),
+        use_system_prompt=model_details.get("system_prompt", True)
+    )
+
+def create_translator_pool(models: dict, names: list, proxy_config: dict = None, pool_size: int = 1):
+    """Builds a TranslatorPool over the named entries of the `models` section of config.json."""
+    missing = [name for name in names if name not in models]
+    if missing:
+        raise ValueError(f"未找到模型配置: {', '.join(missing)}")
+    return model_pool.TranslatorPool([create_translator(models[name], proxy_config, pool_size, use_async=False) for name in names])
+
+def create_hedged_translator(primary, secondary=None, max_concurrency: int = 1):
+    """Wraps a Translator or TranslatorPool so that batches running past the observed p95 latency are duplicated."""
+    if isinstance(primary, async_translator.AsyncTranslator) or isinstance(secondary, async_translator.AsyncTranslator):
+        raise ValueError("对冲请求暂不支持异步翻译引擎，请关闭其中之一。")
+    return hedging.HedgedTranslator(primary, secondary, max_workers=2 * max(max_concurrency, 1))
+
+def normalize_prompt_template(text: str) -> str:
+    """Prompt template as used for requests and translation memory keys: surrounding whitespace (such as the newline
+    a Tk Text widget always appends) is dropped, and an empty template falls back to the default one."""
+    return (text or "").strip() or translator.DEFAULT_PROMPT_TEMPLATE
+
+def parse_targets(text: str) -> list:
+    """Parses extra targets written as "D=日语, E=法语" into [("D", "日语"), ("E", "法语")]."""
+    targets = []
+    for item in re.split(r"[,，;；\n]", text or ""):
+        if not item.strip():
+            continue
+        col, sep, language = item.partition("=")
+        col, language = col.strip().upper(), language.strip()
+        if not sep or not re.fullmatch(r"[A-Z]{1,3}", col) or not language:
+            raise ValueError(f"无法解析目标设置 '{item.strip()}'，格式应为 列=语言，例如 D=日语。")
+        targets.append((col, language))
+    return targets
+
+class TargetLane:
+    """The part of a job that goes into one target column, in one target language."""
+
+    def __init__(self, tgt_col, target_language):
+        self.tgt_col = tgt_col
+        self.target_language = target_language
+        self.job_key = None
+        # Translations are collected as {row: text} and written back in one pass when the job ends.
+        self.results = {}
+        # Unique source texts still to translate, the rows each one fans out to, and how many have been sent.
+        self.segments = []
+        self.row_map = []
+        self.sent = 0
+        self.failed_rows = 0
+
+class TranslationJob:
+    """One source column of one sheet translated into one or more target columns. `sheet_name` defaults
+    to the active sheet; `extra_targets` adds (column, language) pairs next to tgt_col/target_language,
+    so several languages are produced from a single read and a single save."""
+
+    def __init__(self, file_path, src_col, tgt_col, start_row, source_language, target_language, prompt_template, preview_data=None, sheet_name=None, extra_targets=()):
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.src_col = src_col
+        self.tgt_col = tgt_col
+        self.start_row = int(start_row)
+        self.source_language = source_language
+        self.target_language = target_language
+        self.prompt_template = normalize_prompt_template(prompt_template)
+        self.preview_data = preview_data
+        self.lanes = [TargetLane(tgt_col, target_language)] + [TargetLane(col, language) for col, language in extra_targets]
+        if len({lane.tgt_col for lane in self.lanes}) != len(self.lanes):
+            raise ValueError("同一目标列不能对应多个目标语言。")
+        self.sheet_title = None
+        self.total_rows = 0
+        self.progress = None
+        self.journal = None
+        self.metrics = metrics.TranslationMetrics()
+        self.error = None
+        self.pending_batches = 0
+        self._turn = 0
+
+    @property
+    def failed_rows(self):
+        return sum(lane.failed_rows for lane in self.lanes)
+
+    def _read_sources(self):
+        src_col_idx = column_index_from_string(self.src_col)
+        preview_data = self.preview_data
+        # Finishing a half-loaded preview would hold every column of every row in memory just to take one of them.
+        if preview_data and preview_data.complete and preview_data.matches(self.file_path) and self.sheet_name in (None, preview_data.title):
+            logger.info("复用预览时已加载的工作表数据。")
+            source_values = preview_data.column_values(src_col_idx, self.start_row)
+            return preview_data.title, source_values
+        return excel_io.read_column(self.file_path, src_col_idx, self.start_row, self.sheet_name)
+
+    def prepare(self, model_id, memory=None):
+        """Reads the source column once, then restores journaled rows and cache hits per target and leaves the rest in each lane's segments/row_map."""
+        self.sheet_title, source_values = self._read_sources()
+
+        # Identical cells are translated once and fanned out to every row; blank cells are skipped.
+        rows_by_source = {}
+        for r_idx, cell_value in enumerate(source_values, start=self.start_row):
+            source = str(cell_value) if cell_value is not None else ""
+            if source.strip():
+                rows_by_source.setdefault(source, []).append(r_idx)
+        del source_values
+
+        self.total_rows = sum(len(rows) for rows in rows_by_source.values())
+        if not rows_by_source:
+            logger.info("在指定列中未找到需要翻译的文本。")
+            return
+        logger.info(f"共找到 {self.total_rows} 行文本准备翻译，去重后 {len(rows_by_source)} 条。")
+
+        self.journal = job_journal.JobJournal.for_workbook(self.file_path)
+        for lane in self.lanes:
+            self._prepare_lane(lane, rows_by_source, model_id, memory)
+        self.progress = metrics.JobProgress(sum(len(rows) for lane in self.lanes for rows in lane.row_map))
+
+    def _prepare_lane(self, lane, rows_by_source, model_id, memory):
+        prefix = f"[{lane.target_language}] " if len(self.lanes) > 1 else ""
+        rows_by_source = {source: list(rows) for source, rows in rows_by_source.items()}
+        lane.job_key = job_journal.make_job_key(self.file_path, self.sheet_title, self.src_col, lane.tgt_col, self.start_row, self.source_language, lane.target_language)
+        finished_rows = self.journal.load(lane.job_key)
+        if finished_rows:
+            for source in list(rows_by_source):
+                pending_rows = []
+                for original_row in rows_by_source[source]:
+                    if original_row in finished_rows:
+                        lane.results[original_row] = finished_rows[original_row]
+                    else:
+                        pending_rows.append(original_row)
+                if pending_rows:
+                    rows_by_source[source] = pending_rows
+                else:
+                    del rows_by_source[source]
+            logger.info(f"{prefix}从断点记录中恢复 {len(finished_rows)} 行，剩余 {len(rows_by_source)} 条待翻译。")
+
+        if memory:
+            cached = memory.get_many(list(rows_by_source), self.source_language, lane.target_language, model_id, self.prompt_template)
+            for source, translation in cached.items():
+                for original_row in rows_by_source.pop(source):
+                    lane.results[original_row] = translation
+            logger.info(f"{prefix}翻译记忆命中 {len(cached)} 条，剩余 {len(rows_by_source)} 条需要调用API。")
+
+        lane.segments = list(rows_by_source)
+        lane.row_map = [rows_by_source[source] for source in lane.segments]
+
+    def has_unsent(self) -> bool:
+        return any(lane.sent < len(lane.segments) for lane in self.lanes)
+
+    def next_batch(self, sizer):
+        """Cuts the next batch, taking the targets in turn so every language progresses together.
+
+        Returns (lane, sources, row_map), or None once everything has been sent."""
+        for _ in range(len(self.lanes)):
+            lane = self.lanes[self._turn]
+            self._turn = (self._turn + 1) % len(self.lanes)
+            if lane.sent < len(lane.segments):
+                batch_end = sizer.next_batch_end(lane.segments, lane.sent)
+                batch = (lane, lane.segments[lane.sent:batch_end], lane.row_map[lane.sent:batch_end])
+                lane.sent = batch_end
+                return batch
+        return None
+
+    def apply(self, lane, batch_sources, batch_row_map, translated_texts, model_id, memory=None, committed=(), streamed=False):
+        """Stores finished segments and journals/caches the ones that succeeded.
+
+        Indexes in `committed` were already stored while the batch was streaming in and are skipped."""
+        if len(translated_texts) != len(batch_sources):
+            logger.error(f"批次翻译失败: 返回结果数量 ({len(translated_texts)}) 与源文本数量 ({len(batch_sources)}) 不匹配。")
+            translated_texts = ["[批次翻译失败:行数不匹配]"] * len(batch_sources)
+
+        succeeded = []
+        rows = 0
+        for index, (source, original_rows, translated_text) in enumerate(zip(batch_sources, batch_row_map, translated_texts)):
+            if index in committed:
+                continue
+            rows += len(original_rows)
+            for original_row in original_rows:
+                lane.results[original_row] = translated_text
+            if translator.is_error_result(translated_text):
+                lane.failed_rows += len(original_rows)
+            else:
+                succeeded.append((source, original_rows, translated_text))
+
+        self.journal.record(lane.job_key, [(original_row, t) for _, original_rows, t in succeeded for original_row in original_rows])
+        if memory:
+            memory.put_many([(s, t) for s, _, t in succeeded], self.source_language, lane.target_language, model_id, self.prompt_template)
+
+        self.progress.advance(rows)
+        prefix = f"[{lane.target_language}] " if len(self.lanes) > 1 else ""
+        if streamed:
+            logger.debug(f"{prefix}流式提交 {len(batch_sources)} 条 ({rows} 行)。")
+        else:
+            logger.info(f"{prefix}批次 ({len(batch_sources)} 条, {rows} 行) 已在内存中处理完成。")
+
+    def save(self):
+        if self.failed_rows:
+            logger.warning(f"{self.failed_rows} 行翻译失败，请检查Excel文件中的错误信息。准备保存文件...")
+        else:
+            logger.info("所有批次处理完毕，准备保存文件...")
+        excel_io.write_columns(self.file_path, self.sheet_title, {column_index_from_string(lane.tgt_col): lane.results for lane in self.lanes})
+        self.journal.finish(*(lane.job_key for lane in self.lanes))
+        self.journal = None
+        logger.info(f"所有翻译任务完成并成功保存到文件: {self.file_path}")
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    @property
+    def report_path(self):
+        """Base path of the metrics report; one per sheet when a sheet was named explicitly."""
+        return f"{self.file_path}.{self.sheet_name}" if self.sheet_name else self.file_path
+
+    def info(self, model_id) -> dict:
+        return {
+            "file": self.file_path, "sheet": self.sheet_title, "source_column": self.src_col, "target_column": self.tgt_col,
+            "source_language": self.source_language, "target_language": self.target_language, "model_id": model_id,
+            "targets": [{"column": lane.tgt_col, "language": lane.target_language, "failed_rows": lane.failed_rows} for lane in self.lanes],
+            "total_rows": self.total_rows, "rows_sent": self.progress.total_rows if self.progress else 0,
+            "unique_segments_sent": sum(len(lane.segments) for lane in self.lanes), "failed_rows": self.failed_rows,
+            "elapsed_seconds": round(self.progress.elapsed, 3) if self.progress else 0,
+            "rows_per_second": round(self.progress.rows_per_second, 3) if self.progress else 0,
+        }
+
+class _EventLoopThread:
+    """Runs an AsyncTranslator's batches on one asyncio loop in a daemon thread; submit() hands back
+    concurrent.futures.Future objects, so the scheduler treats them like thread pool results."""
+
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="translator-loop", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # The client's connection pool is bound to this loop, so it has to be closed before the loop goes.
+        self.submit(self.client.aclose()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+def run_translation_job(job, translator_client, max_concurrency=1, memory=None, on_progress=None, export_report=True):
+    """Runs `job` to completion through `translator_client` with up to `max_concurrency` batches in flight.
+
+    `on_progress(progress)` is called from this thread after every batch. Returns the job; raises whatever stopped it."""
+    run_translation_queue(
+        [job], translator_client, max_concurrency, memory=memory,
+        on_progress=(lambda finished_job: on_progress(finished_job.progress)) if on_progress else None,
+        export_report=export_report
+    )
+    if job.error:
+        raise job.error
+    return job
+
+def run_translation_queue(jobs, translator_client, max_concurrency=1, memory=None, on_progress=None, export_report=True, prefetch=2):
+    """Runs several jobs through one pool of `max_concurrency` API workers and one Translator, so
+    connection pool, batch sizing and rate limits are shared across all of them.
+
+    Up to `prefetch` jobs are read ahead on a loader thread and finished jobs are saved on a saver
+    thread, so the next job's batches are already in flight while the previous workbook loads or saves.
+    A job that fails is logged and keeps the exception in `job.error`; the others carry on.
+    `on_progress(job)` is called from this thread whenever a job advances. Returns the jobs."""
+    model_id = translator_client.model_id
+    sizer = translator_client.batch_sizer
+    # Loading and saving run on different threads; never read a workbook while it is being written.
+    file_locks = {os.path.abspath(job.file_path): threading.Lock() for job in jobs}
+
+    def load(job):
+        with file_locks[os.path.abspath(job.file_path)]:
+            job.prepare(model_id, memory)
+
+    def save(job):
+        try:
+            if job.progress and not job.error:
+                with file_locks[os.path.abspath(job.file_path)]:
+                    job.save()
+        except Exception as e:
+            fail(job, e)
+        finally:
+            job.close()
+            if export_report and job.progress:
+                try:
+                    job.metrics.export(job.report_path, job.info(model_id))
+                except Exception as e:
+                    logger.error(f"导出翻译统计报告失败: {e}")
+
+    def commit_streamed():
+        # Segments that arrived mid-stream are stored right away, grouped per batch to keep journal writes few.
+        groups = {}
+        while not streamed.empty():
+            entry, index, translation = streamed.get()
+            job, committed = entry[0], entry[4]
+            if job.error or index in committed:
+                continue
+            committed.add(index)
+            groups.setdefault(id(entry), (entry, []))[1].append((index, translation))
+        for (job, lane, batch_sources, batch_row_map, _), items in groups.values():
+            try:
+                job.apply(lane, [batch_sources[i] for i, _ in items], [batch_row_map[i] for i, _ in items], [t for _, t in items],
+                          model_id, memory, streamed=True)
+            except Exception as e:
+                fail(job, e)
+            if on_progress:
+                on_progress(job)
+
+    def fail(job, error):
+        if not job.error:
+            job.error = error
+            logger.error(f"任务失败 ({job.file_path} / {job.sheet_title or job.sheet_name or '活动工作表'}): {error}", exc_info=error)
+
+    waiting = deque(jobs)
+    loading = deque()
+    in_flight = {}
+    current = None
+    # Only JSON replies identify each segment, so only they can be committed before the reply is complete.
+    streaming = translator_client.streams_segments
+    streamed = queue.SimpleQueue()
+    logger.info(f"共 {len(jobs)} 个翻译任务，初始批次Token预算: {sizer.token_budget}，并发数: {max_concurrency}")
+
+    # A coroutine client runs every batch on one event loop instead of one worker thread per batch in flight.
+    is_async = asyncio.iscoroutinefunction(translator_client.translate_batch)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as api, \
+            ThreadPoolExecutor(max_workers=1) as loader, \
+            ThreadPoolExecutor(max_workers=1) as saver, \
+            (_EventLoopThread(translator_client) if is_async else contextlib.nullcontext()) as event_loop:
+        while True:
+            while waiting and len(loading) < prefetch:
+                job = waiting.popleft()
+                loading.append((job, loader.submit(load, job)))
+
+            # Keep the window full, moving on to the next loaded job as soon as the current one has nothing left to submit.
+            while len(in_flight) < max_concurrency:
+                if current is None or current.error or not current.has_unsent():
+                    if not loading or not loading[0][1].done():
+                        break
+                    job, future = loading.popleft()
+                    if waiting:
+                        next_job = waiting.popleft()
+                        loading.append((next_job, loader.submit(load, next_job)))
+                    current = job
+                    try:
+                        future.result()
+                    except Exception as e:
+                        fail(job, e)
+                    if on_progress and job.progress:
+                        on_progress(job)
+                    if job.error or not job.has_unsent():
+                        saver.submit(save, job)
+                        current = None
+                    continue
+                # Batches are cut right before submission so each one picks up the latest token budget.
+                lane, batch_sources, batch_row_map = current.next_batch(sizer)
+                entry = (current, lane, batch_sources, batch_row_map, set())
+                args = (
+                    batch_sources,
+                    current.prompt_template,
+                    current.source_language,
+                    lane.target_language,
+                    current.metrics,
+                    (lambda index, translation, entry=entry: streamed.put((entry, index, translation))) if streaming else None
+                )
+                if is_async:
+                    future = event_loop.submit(translator_client.translate_batch(*args))
+                else:
+                    future = api.submit(translator_client.translate_batch, *args)
+                in_flight[future] = entry
+                current.pending_batches += 1
+
+            if not in_flight and not loading and not waiting:
+                break
+            waiting_on = list(in_flight)
+            # A loaded job is only picked up once a slot frees, so a done load must not keep waking this loop.
+            if loading and len(in_flight) < max_concurrency and not loading[0][1].done():
+                waiting_on.append(loading[0][1])
+            wait(waiting_on, timeout=0.2 if streaming else None, return_when=FIRST_COMPLETED)
+            # Results are only touched on this thread. A batch streams its segments before it completes, so once
+            # the done batches are known, draining the queue picks up every segment they streamed.
+            done = [f for f in in_flight if f.done()]
+            commit_streamed()
+            for future in done:
+                job, lane, batch_sources, batch_row_map, committed = in_flight.pop(future)
+                job.pending_batches -= 1
+                if not job.error:
+                    try:
+                        job.apply(lane, batch_sources, batch_row_map, future.result(), model_id, memory, committed)
+                    except Exception as e:
+                        fail(job, e)
+                    if on_progress:
+                        on_progress(job)
+                # Anything the batch still streams from here on (a hedged duplicate, say) is a duplicate.
+                committed.update(range(len(batch_sources)))
+                if job.pending_batches == 0 and (job.error or not job.has_unsent()):
+                    saver.submit(save, job)
+                    if job is current:
+                        current = None
+
+    failed = [job for job in jobs if job.error]
+    if len(jobs) > 1:
+        logger.info(f"全部任务结束: 成功 {len(jobs) - len(failed)} 个，失败 {len(failed)} 个。")
+    return jobs
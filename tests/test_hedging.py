@@ -0,0 +1,40 @@
+import unittest
+import hedging
+import metrics
+import translator
+
+class StubClient:
+    streams_segments = False
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.batch_sizer = translator.AdaptiveBatchSizer()
+        self.metrics = metrics.TranslationMetrics()
+
+    def translate_batch(self, sources, prompt_template, source_language, target_language, metrics=None, on_segment=None, cancelled=None):
+        return [f"{self.model_id}: {source}" for source in sources]
+
+class HedgedTranslatorTest(unittest.TestCase):
+    def test_memory_key_names_both_models(self):
+        hedged = hedging.HedgedTranslator(StubClient("b"), StubClient("a"))
+        self.addCleanup(hedged.close)
+        self.assertEqual(hedged.model_id, "a+b")
+
+    def test_same_model_keeps_its_id(self):
+        primary = StubClient("a")
+        hedged = hedging.HedgedTranslator(primary)
+        self.addCleanup(hedged.close)
+        self.assertEqual(hedged.model_id, "a")
+        twin = hedging.HedgedTranslator(primary, StubClient("a"))
+        self.addCleanup(twin.close)
+        self.assertEqual(twin.model_id, "a")
+
+    def test_close_stops_the_worker_threads(self):
+        hedged = hedging.HedgedTranslator(StubClient("a"))
+        self.assertEqual(hedged.translate_batch(["x"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh"), ["a: x"])
+        hedged.close()
+        with self.assertRaises(RuntimeError):
+            hedged.translate_batch(["x"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import time
+import unittest
+import metrics
+import model_pool
+import translator
+
+class FakeClient:
+    """Translator stand-in that answers from a list of scripted outcomes: "ok" or "429" (with a Retry-After of
+    `retry_after` seconds)."""
+
+    def __init__(self, model_id, outcomes, retry_after=0.05):
+        self.model_id = model_id
+        self.outcomes = list(outcomes)
+        self.retry_after = retry_after
+        self.batch_sizer = translator.AdaptiveBatchSizer()
+        self.metrics = metrics.TranslationMetrics()
+        self.streams_segments = False
+        self.rate_limiter = None
+        self.retry_policy = translator.RetryPolicy()
+        self.max_rate_limit_wait = None
+        self.blocked_until = 0.0
+        self.calls = 0
+
+    def translate_batch(self, sources, prompt_template, source_language, target_language, metrics=None, on_segment=None, cancelled=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome == "429":
+            self.blocked_until = time.monotonic() + self.retry_after
+            return ["[HTTP错误 429]: slow down"] * len(sources)
+        return [f"{self.model_id}: {source}" for source in sources]
+
+def translate(pool, sources=("a",)):
+    return pool.translate_batch(list(sources), translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+
+class CooldownTest(unittest.TestCase):
+    def test_cooldown_follows_retry_after(self):
+        pool = model_pool.TranslatorPool([FakeClient("a", []), FakeClient("b", [])], cooldown=30)
+        member = pool.members[0]
+        started = time.monotonic()
+        member.client.blocked_until = started + 2.0
+        member.in_flight += 1
+        pool._record(member, started, 1, True, True)
+        self.assertEqual(member.cooldown_until, started + 2.0)
+        self.assertEqual(member.failures, 0)
+
+    def test_failures_in_flight_together_count_once(self):
+        pool = model_pool.TranslatorPool([FakeClient("a", []), FakeClient("b", [])], cooldown=30)
+        member = pool.members[0]
+        started = time.monotonic()
+        for _ in range(8):
+            member.in_flight += 1
+            pool._record(member, started, 1, True, True)
+        self.assertEqual(member.failures, 1)
+        self.assertAlmostEqual(member.cooldown_until - started, 30, delta=1)
+
+    def test_failure_after_cooldown_escalates(self):
+        pool = model_pool.TranslatorPool([FakeClient("a", []), FakeClient("b", [])], cooldown=30, max_cooldown=50)
+        member = pool.members[0]
+        for expected in (30, 50, 50):
+            member.cooldown_until = 0.0
+            member.in_flight += 1
+            started = time.monotonic()
+            pool._record(member, started, 1, True, True)
+            self.assertAlmostEqual(member.cooldown_until - started, expected, delta=1)
+        member.in_flight += 1
+        pool._record(member, time.monotonic() - 1, 1, False, False)
+        self.assertEqual(member.failures, 0)
+
+class RoundsTest(unittest.TestCase):
+    def test_short_rate_limit_on_every_member_is_waited_out(self):
+        clients = [FakeClient("a", ["429"]), FakeClient("b", ["429"])]
+        pool = model_pool.TranslatorPool(clients, cooldown=30)
+        result = translate(pool, ["x", "y"])
+        self.assertIn(result, (["a: x", "a: y"], ["b: x", "b: y"]))
+        self.assertEqual(sum(client.calls for client in clients), 3)
+
+    def test_gives_up_after_the_last_round(self):
+        clients = [FakeClient("a", ["429"] * 5), FakeClient("b", ["429"] * 5)]
+        pool = model_pool.TranslatorPool(clients, cooldown=30, rounds=2)
+        self.assertTrue(translator.is_error_result(translate(pool)[0]))
+        self.assertEqual(sum(client.calls for client in clients), 4)
+
+    def test_model_errors_are_not_retried_in_rounds(self):
+        clients = [FakeClient("a", []), FakeClient("b", [])]
+        for client in clients:
+            client.translate_batch = lambda sources, *args, **kwargs: ["[翻译结果行数校验失败] 预期 1 行, 收到 2 行。"] * len(sources)
+        pool = model_pool.TranslatorPool(clients)
+        self.assertTrue(translate(pool)[0].startswith("[翻译结果行数校验失败]"))
+
+if __name__ == "__main__":
+    unittest.main()
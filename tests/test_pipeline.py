@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+import openpyxl
+import metrics
+import pipeline
+import translator
+
+class StreamingStub:
+    """Streams every segment through on_segment before returning the whole batch, like a JSON-mode stream."""
+    model_id = "stub"
+    streams_segments = True
+
+    def __init__(self):
+        self.batch_sizer = translator.AdaptiveBatchSizer(token_budget=100)
+        self.metrics = metrics.TranslationMetrics()
+
+    def translate_batch(self, sources, prompt_template, source_language, target_language, metrics=None, on_segment=None, cancelled=None):
+        for index, source in enumerate(sources):
+            on_segment(index, f"T {source}")
+        return [f"T {source}" for source in sources]
+
+class SlowStub:
+    """Answers every batch after `delay` seconds without streaming."""
+    model_id = "slow"
+    streams_segments = False
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.batch_sizer = translator.AdaptiveBatchSizer(token_budget=100)
+        self.metrics = metrics.TranslationMetrics()
+
+    def translate_batch(self, sources, prompt_template, source_language, target_language, metrics=None, on_segment=None, cancelled=None):
+        time.sleep(self.delay)
+        return [f"T {source}" for source in sources]
+
+class QueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def make_job(self, name, rows):
+        workbook = openpyxl.Workbook()
+        for row in range(1, rows + 1):
+            workbook.active.cell(row, 2, f"{name} text {row}")
+        file_path = os.path.join(self.folder, f"{name}.xlsx")
+        workbook.save(file_path)
+        return pipeline.TranslationJob(file_path, "B", "C", 1, "en", "zh", translator.DEFAULT_PROMPT_TEMPLATE)
+
+class StreamedCommitTest(QueueTestCase):
+    def test_streamed_segments_are_applied_once(self):
+        jobs = [self.make_job("a", 3000), self.make_job("b", 500)]
+        pipeline.run_translation_queue(jobs, StreamingStub(), max_concurrency=8, export_report=False)
+        for job in jobs:
+            self.assertIsNone(job.error)
+            self.assertEqual(job.progress.done_rows, job.total_rows)
+        sheet = openpyxl.load_workbook(jobs[0].file_path).active
+        self.assertEqual(sheet["C3000"].value, "T a text 3000")
+
+class SchedulerTest(QueueTestCase):
+    def test_loaded_job_does_not_spin_the_scheduler(self):
+        jobs = [self.make_job("a", 59), self.make_job("b", 59)]
+        with mock.patch("pipeline.wait", wraps=pipeline.wait) as waits:
+            pipeline.run_translation_queue(jobs, SlowStub(0.5), max_concurrency=2, export_report=False)
+        for job in jobs:
+            self.assertIsNone(job.error)
+            self.assertEqual(job.progress.done_rows, job.total_rows)
+        self.assertLess(waits.call_count, 50)
+
+class PromptTemplateTest(unittest.TestCase):
+    def test_gui_and_cli_templates_match(self):
+        # The GUI hands over the Text widget's content with its trailing newline; config.json stores it stripped.
+        self.assertEqual(pipeline.TranslationJob("a.xlsx", "B", "C", 1, "en", "zh", "Translate.\n").prompt_template, "Translate.")
+        self.assertEqual(pipeline.normalize_prompt_template("  \n"), translator.DEFAULT_PROMPT_TEMPLATE)
+
+if __name__ == "__main__":
+    unittest.main()
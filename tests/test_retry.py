@@ -0,0 +1,187 @@
+import email.utils
+import threading
+import time
+import unittest
+from unittest import mock
+import translator
+
+class FakeResponse:
+    def __init__(self, headers=None, body=None):
+        self.headers = headers or {}
+        self._body = body
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no JSON body")
+        return self._body
+
+class Clock:
+    """Stands in for time.monotonic inside translator."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class RetryAfterSecondsTest(unittest.TestCase):
+    def test_header_in_seconds(self):
+        self.assertEqual(translator.retry_after_seconds(FakeResponse({"Retry-After": "7"})), 7.0)
+
+    def test_negative_header_is_clamped(self):
+        self.assertEqual(translator.retry_after_seconds(FakeResponse({"Retry-After": "-3"})), 0.0)
+
+    def test_header_as_http_date(self):
+        header = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(translator.retry_after_seconds(FakeResponse({"Retry-After": header})), 60, delta=2)
+
+    def test_gemini_retry_info(self):
+        body = {"error": {"details": [
+            {"@type": "type.googleapis.com/google.rpc.Help"},
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1.5s"},
+        ]}}
+        self.assertEqual(translator.retry_after_seconds(FakeResponse(body=body)), 1.5)
+
+    def test_header_wins_over_retry_info(self):
+        body = {"error": {"details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "30s"}]}}
+        self.assertEqual(translator.retry_after_seconds(FakeResponse({"Retry-After": "2"}, body)), 2.0)
+
+    def test_nothing_to_go_by(self):
+        self.assertIsNone(translator.retry_after_seconds(FakeResponse()))
+        self.assertIsNone(translator.retry_after_seconds(FakeResponse({"Retry-After": "soon"})))
+        self.assertIsNone(translator.retry_after_seconds(FakeResponse(body=["not", "a", "dict"])))
+        self.assertIsNone(translator.retry_after_seconds(FakeResponse(body={"error": {"details": [
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "later"}]}})))
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_backoff_stays_within_the_capped_exponential(self):
+        policy = translator.RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=5.0)
+        for attempt in range(6):
+            for _ in range(50):
+                self.assertTrue(0 <= policy.delay(attempt) <= min(5.0, 2 ** attempt))
+
+    def test_retry_after_is_never_cut_short(self):
+        policy = translator.RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for _ in range(50):
+            self.assertGreaterEqual(policy.delay(0, retry_after=30.0), 30.0)
+
+    def test_at_least_one_attempt(self):
+        self.assertEqual(translator.RetryPolicy(max_attempts=0).max_attempts, 1)
+        self.assertEqual(translator.RetryPolicy(max_attempts="3").max_attempts, 3)
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("translator.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = translator.CircuitBreaker(failure_ratio=0.8, window=10, min_requests=5, reset_timeout=30, max_reset_timeout=100)
+
+    def trip(self):
+        for _ in range(5):
+            self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+    def test_needs_min_requests_before_opening(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+    def test_stays_closed_below_failure_ratio(self):
+        for _ in range(10):
+            self.breaker.record_success()
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_single_probe_after_reset_timeout(self):
+        self.trip()
+        self.assertEqual(self.breaker.retry_at, self.clock.now + 30)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.retry_at, 0.0)
+        self.assertTrue(self.breaker.allow())
+        # The failures from before the outage are forgotten; the probe's success is the only outcome left.
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_doubles_the_pause_up_to_the_cap(self):
+        self.trip()
+        for expected in (60, 100, 100):
+            self.clock.now = self.breaker.retry_at
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.retry_at, self.clock.now + expected)
+        self.clock.now = self.breaker.retry_at
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.reset_timeout, 30)
+
+    def test_abandoned_probe_lets_another_one_out(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_abandoned()
+        self.assertTrue(self.breaker.allow())
+
+    def test_failures_while_open_do_not_extend_the_pause(self):
+        self.trip()
+        retry_at = self.breaker.retry_at
+        self.clock.now += 10
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.retry_at, retry_at)
+
+class OpenBreakerHoldTest(unittest.TestCase):
+    """A batch meeting an open breaker waits for its turn to probe instead of failing."""
+
+    def make_translator(self, name):
+        client = translator.Translator("key", "model", custom_api_url=f"http://breaker-test/{name}",
+                                       retry_policy=translator.RetryPolicy(max_attempts=2))
+        client.circuit_breaker = translator.CircuitBreaker(min_requests=1, reset_timeout=0.05)
+        client.circuit_breaker.record_failure()
+        client._send = lambda body, count, on_segment, stats, cancelled=None: (translator.LINE_SEPARATOR.join(["x"] * count), {}, {})
+        return client
+
+    def test_batch_is_held_then_sent_as_probe(self):
+        client = self.make_translator("hold")
+        result = client.translate_batch(["a", "b"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+        self.assertEqual(result, ["x", "x"])
+        self.assertTrue(client.circuit_breaker.allow())
+        self.assertGreater(client.metrics.records[0].backoff_wait, 0)
+
+    def test_pool_member_is_refused_at_once(self):
+        client = self.make_translator("refuse")
+        client.max_rate_limit_wait = 0
+        result = client.translate_batch(["a"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+        self.assertTrue(result[0].startswith("[接口熔断"))
+        self.assertGreater(client.blocked_until, 0)
+
+    def test_endpoint_down_for_good_fails_at_once(self):
+        client = self.make_translator("down")
+        client.circuit_breaker.reset_timeout = client.circuit_breaker.max_reset_timeout
+        result = client.translate_batch(["a"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+        self.assertTrue(result[0].startswith("[接口熔断"))
+
+    def test_cancelled_while_held(self):
+        client = self.make_translator("cancel")
+        client.circuit_breaker.reset_timeout = 60
+        cancelled = threading.Event()
+        threading.Timer(0.1, cancelled.set).start()
+        started = time.monotonic()
+        result = client.translate_batch(["a"], translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh", cancelled=cancelled)
+        self.assertEqual(result, [translator.CANCELLED_RESULT])
+        self.assertLess(time.monotonic() - started, 5)
+
+if __name__ == "__main__":
+    unittest.main()
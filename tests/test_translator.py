@@ -0,0 +1,25 @@
+import unittest
+import translator
+
+class BisectionSizingTest(unittest.TestCase):
+    def test_garbled_segment_halves_the_budget_once(self):
+        client = translator.Translator("key", "model", custom_api_url="http://bisect-test/v1")
+
+        def send(body, count, on_segment, stats, cancelled=None):
+            # Any request containing the garbled cell comes back with a line too many.
+            lines = ["x"] * count
+            if b"garbled" in body:
+                lines.append("x")
+            return translator.LINE_SEPARATOR.join(lines), {}, {}
+
+        client._send = send
+        sources = [f"row {i}" for i in range(128)]
+        sources[77] = "garbled"
+        budget = client.batch_sizer.token_budget
+        result = client.translate_batch(sources, translator.DEFAULT_PROMPT_TEMPLATE, "en", "zh")
+        self.assertTrue(result[77].startswith("[翻译结果行数校验失败]"))
+        self.assertEqual(sum(translator.is_error_result(t) for t in result), 1)
+        self.assertEqual(client.batch_sizer.token_budget, budget // 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "translation_memory.sqlite3"
+DEFAULT_MAX_ENTRIES = 200000
+# SQLite's default limit on bound parameters per statement is 999.
+_QUERY_CHUNK = 500
+
+def make_key(source: str, source_language: str, target_language: str, model_id: str, prompt_template: str) -> str:
+    raw = json.dumps([source, source_language, target_language, model_id, prompt_template], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class TranslationMemory:
+    """On-disk cache of finished translations with a size cap and least-recently-used eviction."""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " translation TEXT NOT NULL,"
+                " model_id TEXT,"
+                " source_language TEXT,"
+                " target_language TEXT,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used)")
+
+    def get_many(self, sources, source_language, target_language, model_id, prompt_template) -> dict:
+        """Returns {source: translation} for every source already in the cache."""
+        keys = {make_key(s, source_language, target_language, model_id, prompt_template): s for s in set(sources)}
+        key_list = list(keys)
+        hits = {}
+        with self._lock, self._conn:
+            for i in range(0, len(key_list), _QUERY_CHUNK):
+                chunk = key_list[i:i + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT key, translation FROM entries WHERE key IN ({placeholders})", chunk).fetchall()
+                for key, translation in rows:
+                    hits[keys[key]] = translation
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE entries SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time()] + [key for key, _ in rows]
+                    )
+        return hits
+
+    def put_many(self, pairs, source_language, target_language, model_id, prompt_template):
+        """Stores (source, translation) pairs and evicts the least recently used entries beyond the cap."""
+        now = time.time()
+        rows = [
+            (make_key(source, source_language, target_language, model_id, prompt_template), translation, model_id, source_language, target_language, now)
+            for source, translation in pairs
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            overflow = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)", (overflow,))
+                logger.debug(f"翻译记忆已满，淘汰 {overflow} 条最久未使用的记录。")
+
+    def invalidate(self, model_id=None, source_language=None, target_language=None) -> int:
+        """Deletes entries matching every given filter; with no filters the whole cache is cleared."""
+        conditions, params = [], []
+        for column, value in (("model_id", model_id), ("source_language", source_language), ("target_language", target_language)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock, self._conn:
+            deleted = self._conn.execute(f"DELETE FROM entries{where}", params).rowcount
+        logger.info(f"已从翻译记忆中删除 {deleted} 条记录。")
+        return deleted
+
+    def clear(self) -> int:
+        return self.invalidate()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
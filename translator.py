@@ -1,14 +1,363 @@
 import requests
+from requests.adapters import HTTPAdapter
+import gzip
 import json
 import logging
+import random
 import re
+import threading
 import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from metrics import RequestStats, TranslationMetrics
 
 logger = logging.getLogger(__name__)
 
 # A unique separator that is unlikely to appear in the text.
 LINE_SEPARATOR = "|||---|||"
 
+DEFAULT_PROMPT_TEMPLATE = f"You are an expert translator. Your task is to translate a batch of texts from {{source_language}} to {{target_language}}. The texts are separated by a unique delimiter: '{LINE_SEPARATOR}'.\n\n**CRITICAL INSTRUCTIONS:**\n1.  Translate each segment of text between the delimiters individually.\n2.  You MUST preserve the exact same delimiter '{LINE_SEPARATOR}' between each translated segment.\n3.  The number of delimiters in your output MUST be exactly one less than the number of text segments in the input.\n4.  If a segment in the input is empty or contains only whitespace, you MUST output an empty segment in its place, followed by the delimiter.\n5.  Do NOT add any extra text, explanations, or formatting. Your response should only contain the translated texts separated by the specified delimiter.\n\n**EXAMPLE:**\n- **INPUT TEXT:**\nHello world{LINE_SEPARATOR}{LINE_SEPARATOR}How are you?\n- **EXPECTED OUTPUT (to Spanish):**\nHola mundo{LINE_SEPARATOR}{LINE_SEPARATOR}¿Cómo estás?\n\n--- TEXT TO TRANSLATE ---\n{{text_to_translate}}"
+
+RESPONSE_MODE_SEPARATOR = "separator"
+RESPONSE_MODE_JSON = "json"
+
+DEFAULT_JSON_PROMPT_TEMPLATE = (
+    "You are an expert translator. Your task is to translate a batch of texts from {source_language} to {target_language}. "
+    "The texts are given as a JSON array of objects with an \"id\" and a \"text\".\n\n"
+    "**CRITICAL INSTRUCTIONS:**\n"
+    "1.  Translate the \"text\" of each object individually.\n"
+    "2.  Reply with a single JSON object that maps every id, as a string, to its translation, for example {{\"0\": \"...\", \"1\": \"...\"}}.\n"
+    "3.  Include every id exactly once. If a text is empty or contains only whitespace, its translation is an empty string.\n"
+    "4.  Do NOT add any extra text, explanations, or formatting outside the JSON object.\n\n"
+    "--- TEXT TO TRANSLATE ---\n{text_to_translate}"
+)
+
+_TEXT_PLACEHOLDER = "{text_to_translate}"
+
+def split_prompt(prompt_template: str, source_language: str, target_language: str, text_to_translate: str) -> tuple:
+    """Formats the template as (instructions, user message): everything before {text_to_translate} becomes the
+    instructions, which stay byte-identical for every batch of a job, and the text plus anything after it the user message.
+
+    A template without a plain {text_to_translate} placeholder comes back whole as the user message, with no instructions."""
+    fields = dict(source_language=source_language, target_language=target_language,
+                  text_to_translate=text_to_translate, line_separator=LINE_SEPARATOR)
+    head, placeholder, tail = prompt_template.partition(_TEXT_PLACEHOLDER)
+    if not placeholder:
+        return "", prompt_template.format(**fields)
+    return head.format(**fields).rstrip(), text_to_translate + tail.format(**fields).rstrip()
+
+_JSON_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+def parse_json_translations(raw_content: str, count: int) -> dict:
+    """Reads {index: translation} from a JSON-mode reply.
+
+    Also accepts a list of {"id", "text"} objects or either form wrapped in a "translations" key.
+    Ids outside 0..count-1 and non-string translations are dropped, so a partly broken reply still yields what it can."""
+    try:
+        data = json.loads(_JSON_FENCE_PATTERN.sub("", raw_content.strip()))
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(data, dict) and isinstance(data.get("translations"), (dict, list)):
+        data = data["translations"]
+    if isinstance(data, list):
+        data = {item.get("id"): item.get("text", item.get("translation")) for item in data if isinstance(item, dict)}
+    if not isinstance(data, dict):
+        return {}
+    translations = {}
+    for key, value in data.items():
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and isinstance(value, str):
+            translations[index] = value.strip()
+    return translations
+
+_JSON_PAIR_PATTERN = re.compile(r'"(\d+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+class JsonSegmentScanner:
+    """Picks complete "id": "translation" pairs out of a JSON-mode reply while it is still streaming in."""
+
+    def __init__(self, count: int):
+        self.count = count
+        self.buffer = ""
+        self.found = {}
+        self._pos = 0
+
+    def feed(self, text: str) -> list:
+        """Adds streamed text; returns the (index, translation) pairs completed by it."""
+        self.buffer += text
+        completed = []
+        for match in _JSON_PAIR_PATTERN.finditer(self.buffer, self._pos):
+            self._pos = match.end()
+            index = int(match.group(1))
+            if index >= self.count or index in self.found:
+                continue
+            try:
+                translation = json.loads(f'"{match.group(2)}"').strip()
+            except json.JSONDecodeError:
+                continue
+            self.found[index] = translation
+            completed.append((index, translation))
+        return completed
+
+def cached_prompt_tokens(usage: dict) -> int:
+    """Prompt tokens served from the provider's prefix cache: DeepSeek reports prompt_cache_hit_tokens,
+    OpenAI-compatible endpoints (Gemini included) prompt_tokens_details.cached_tokens."""
+    if usage.get('prompt_cache_hit_tokens') is not None:
+        return usage['prompt_cache_hit_tokens'] or 0
+    return (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+# Failures are written into the target cells as bracketed messages starting with one of these.
+ERROR_MARKERS = ("[API响应格式错误", "[解析响应时出错]", "[翻译结果行数校验失败]", "[HTTP错误", "[网络错误", "[未知错误", "[批量翻译失败", "[批次翻译失败", "[接口熔断")
+
+def is_error_result(text) -> bool:
+    return isinstance(text, str) and text.startswith(ERROR_MARKERS)
+
+DEFAULT_BATCH_TOKEN_BUDGET = 3000
+# Beyond this many segments models start merging or dropping delimiters, whatever the token count.
+MAX_BATCH_SEGMENTS = 200
+
+def estimate_tokens(text: str, chars_per_token=None) -> int:
+    if chars_per_token:
+        return max(1, int(len(text) / chars_per_token))
+    # Roughly 4 UTF-8 bytes per token holds up for Latin, Cyrillic and CJK alike.
+    return max(1, len(text.encode('utf-8')) // 4)
+
+class AdaptiveBatchSizer:
+    """Cuts batches by estimated token count and tunes the budget from observed latency and line-count mismatches."""
+
+    def __init__(self, token_budget=None, chars_per_token=None, target_latency=30.0, min_budget=200, max_budget=16000):
+        self.token_budget = token_budget or DEFAULT_BATCH_TOKEN_BUDGET
+        self.chars_per_token = chars_per_token
+        self.target_latency = target_latency
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self._separator_tokens = estimate_tokens(LINE_SEPARATOR, chars_per_token)
+        self._lock = threading.Lock()
+
+    def next_batch_end(self, sources: list, start: int) -> int:
+        """Returns the end index of the batch starting at `start`; a batch always holds at least one segment."""
+        budget = self.token_budget
+        used = 0
+        end = start
+        while end < len(sources) and end - start < MAX_BATCH_SEGMENTS:
+            cost = estimate_tokens(sources[end], self.chars_per_token) + self._separator_tokens
+            if end > start and used + cost > budget:
+                break
+            used += cost
+            end += 1
+        return end
+
+    def record(self, latency: float, mismatched: bool = False):
+        with self._lock:
+            if mismatched:
+                factor = 0.5
+            elif latency > self.target_latency:
+                factor = 0.75
+            elif latency < self.target_latency / 3:
+                factor = 1.25
+            else:
+                return
+            old_budget = self.token_budget
+            self.token_budget = int(min(max(old_budget * factor, self.min_budget), self.max_budget))
+        if self.token_budget != old_budget:
+            logger.debug(f"批次Token预算调整: {old_budget} -> {self.token_budget} (耗时 {latency:.1f} 秒, 行数不匹配: {mismatched})")
+
+class RateLimiter:
+    """Token bucket holding a requests/minute and a tokens/minute budget; either may be None (unlimited)."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(self.requests_per_minute, self._request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_allowance = min(self.tokens_per_minute, self._token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def try_acquire(self, tokens=0) -> float:
+        """Takes one request of `tokens` tokens from the budget if it fits and returns 0; otherwise takes nothing
+        and returns the seconds until it would fit."""
+        if self.tokens_per_minute:
+            # A single oversized request must still be able to pass once the bucket is full.
+            tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self._refill()
+            wait = 0.0
+            if self.requests_per_minute and self._request_allowance < 1:
+                wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and self._token_allowance < tokens:
+                wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+            if wait <= 0:
+                self._request_allowance -= 1
+                self._token_allowance -= tokens
+            return wait
+
+    def acquire(self, tokens=0) -> float:
+        """Blocks until one request of `tokens` tokens fits the budget. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def headroom(self) -> float:
+        """Share of the tighter budget currently unused, from 0 (exhausted) to 1 (full)."""
+        with self._lock:
+            self._refill()
+            shares = []
+            if self.requests_per_minute:
+                shares.append(self._request_allowance / self.requests_per_minute)
+            if self.tokens_per_minute:
+                shares.append(self._token_allowance / self.tokens_per_minute)
+        return min(max(min(shares, default=1.0), 0.0), 1.0)
+
+    def settle_tokens(self, estimated, actual):
+        """Corrects the token budget once the response reports the real usage."""
+        if not self.tokens_per_minute or actual is None:
+            return
+        with self._lock:
+            self._token_allowance = max(self._token_allowance - (actual - estimated), -self.tokens_per_minute)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(key, requests_per_minute=None, tokens_per_minute=None):
+    """Returns the limiter shared by every Translator using the same endpoint, API key and model."""
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None or (limiter.requests_per_minute, limiter.tokens_per_minute) != (requests_per_minute, tokens_per_minute):
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+            _rate_limiters[key] = limiter
+        return limiter
+
+# Overloaded or briefly unavailable; anything else in 4xx would fail the same way again.
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# Timeouts, refused or reset connections and replies cut off mid-body.
+RETRYABLE_EXCEPTIONS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+def retry_after_seconds(response):
+    """Returns the wait the server asked for, from a Retry-After header (seconds or HTTP date) or Gemini's RetryInfo, or None."""
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(float(header), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(header).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    try:
+        error_json = response.json()
+        if isinstance(error_json, dict):
+            for detail in error_json.get('error', {}).get('details', []):
+                if detail.get('@type') == 'type.googleapis.com/google.rpc.RetryInfo':
+                    return max(float(detail.get('retryDelay', '').rstrip('s')), 0.0)
+    except (ValueError, AttributeError, TypeError):
+        pass
+    return None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at max_delay; a delay the server asks for is never cut short."""
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after=None) -> float:
+        # Full jitter keeps concurrent batches that failed together from retrying in lockstep.
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(retry_after, backoff) if retry_after is not None else backoff
+
+class CircuitBreaker:
+    """Stops requests to an endpoint once `failure_ratio` of its last `window` attempts failed.
+
+    Judging by the ratio rather than a run of consecutive failures keeps a merely flaky endpoint in use when many
+    batches are in flight at once. At least `min_requests` outcomes are needed before it opens. While open, requests
+    are refused. Once `reset_timeout` has passed, a single request is let through as a probe: success closes the
+    breaker, failure opens it again for twice as long (up to max_reset_timeout)."""
+
+    def __init__(self, failure_ratio=0.8, window=20, min_requests=10, reset_timeout=30.0, max_reset_timeout=300.0):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def retry_at(self) -> float:
+        """Monotonic time at which the next probe may go out; 0 while closed."""
+        return self.opened_at + self.reset_timeout if self.opened_at is not None else 0.0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() < self.retry_at:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("接口已恢复，熔断器关闭。")
+                self.outcomes.clear()
+            self.outcomes.append(True)
+            self.opened_at = None
+            self._probing = False
+            self.reset_timeout = self.base_reset_timeout
+
+    def record_abandoned(self):
+        """For a request given up before it said anything about the endpoint; lets another probe go out."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                self.opened_at = time.monotonic()
+                logger.warning(f"熔断试探请求失败，{self.reset_timeout:.0f} 秒后再次试探。")
+                return
+            if self.opened_at is not None:
+                return
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_requests and failures >= self.failure_ratio * len(self.outcomes):
+                self.opened_at = time.monotonic()
+                logger.error(f"接口最近 {len(self.outcomes)} 次请求中失败 {failures} 次，熔断器打开，{self.reset_timeout:.0f} 秒内不再发送请求。")
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(api_url):
+    """Returns the breaker shared by every Translator sending to `api_url`."""
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(api_url)
+        if breaker is None:
+            breaker = _circuit_breakers[api_url] = CircuitBreaker()
+        return breaker
+
 def fetch_gemini_models(api_key: str, proxy_config: dict = None) -> list[str]:
     api_url = "https://generativelanguage.googleapis.com/v1beta/models"
     headers = {"x-goog-api-key": api_key}
@@ -51,15 +400,120 @@ def fetch_deepseek_models(api_key: str, proxy_config: dict = None) -> list[str]:
     logger.info("成功获取到DeepSeek的静态模型列表。")
     return ['deepseek-chat', 'deepseek-reasoner']
 
+class BatchCancelled(Exception):
+    """Raised inside a request whose `cancelled` event was set, e.g. because a hedged duplicate already won."""
+
+CANCELLED_RESULT = "[批次翻译失败: 已取消]"
+
+# How often a batch held by an open circuit breaker checks whether the probe in flight has settled it.
+BREAKER_POLL_INTERVAL = 1.0
+
+# Steps a request flow yields for the engine to carry out; see Translator._request_flow.
+STEP_SLEEP = "sleep"
+STEP_SEND = "send"
+
+class StreamReader:
+    """Collects one server-sent event stream of chat-completion chunks, fed line by line."""
+
+    def __init__(self, count: int, json_mode: bool, on_segment, stats: RequestStats, started: float):
+        self.scanner = JsonSegmentScanner(count) if json_mode else None
+        self.on_segment = on_segment
+        self.stats = stats
+        self.started = started
+        self.pieces = []
+        self.usage = {}
+        self.finished = False
+        self.error = None
+
+    @property
+    def found(self) -> dict:
+        return self.scanner.found if self.scanner else {}
+
+    @property
+    def complete(self) -> bool:
+        return self.finished or self.error is not None
+
+    def feed(self, line) -> bool:
+        """Handles one line, as bytes or str; returns False once nothing more is expected."""
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.startswith("data:"):
+            return True
+        data = line[5:].strip()
+        if data == "[DONE]":
+            self.finished = True
+            return False
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            message = chunk["error"].get("message", "未知") if isinstance(chunk["error"], dict) else chunk["error"]
+            self.error = f"[API响应格式错误: {message}]"
+            return False
+        self.usage = chunk.get("usage") or self.usage
+        for choice in chunk.get("choices") or []:
+            self.finished = self.finished or bool(choice.get("finish_reason"))
+            piece = (choice.get("delta") or {}).get("content") or ""
+            if not piece:
+                continue
+            if not self.stats.first_token_latency:
+                self.stats.first_token_latency = time.monotonic() - self.started
+            self.pieces.append(piece)
+            if self.scanner:
+                for index, translation in self.scanner.feed(piece):
+                    if self.on_segment:
+                        self.on_segment(index, translation)
+        return True
+
+    def result(self):
+        """Returns (content, usage, {index: translation} already passed to on_segment)."""
+        return self.error or "".join(self.pieces).strip(), self.usage, self.found
+
+class LineCountMismatchError(Exception):
+    def __init__(self, expected, received):
+        super().__init__(f"[翻译结果行数校验失败] 预期 {expected} 行, 收到 {received} 行。")
+        self.expected = expected
+        self.received = received
+
 class Translator:
-    def __init__(self, api_key, model_id, api_provider="Custom", custom_api_url=None, proxy_config=None):
+    # The transport's exceptions, as _request_flow sorts them; AsyncTranslator substitutes httpx's.
+    _status_errors = (requests.exceptions.HTTPError,)
+    _retryable_errors = RETRYABLE_EXCEPTIONS
+    _transport_errors = (requests.exceptions.RequestException,)
+
+    def __init__(self, api_key, model_id, api_provider="Custom", custom_api_url=None, proxy_config=None, pool_size=10,
+                 requests_per_minute=None, tokens_per_minute=None, chars_per_token=None, batch_token_budget=None,
+                 response_mode=RESPONSE_MODE_SEPARATOR, use_response_format=None, stream=False, retry_policy=None,
+                 compress_requests=False, use_system_prompt=True):
         if not api_key or not model_id:
             raise ValueError("API密钥和模型ID不能为空。")
         
         self.api_key = api_key
         self.model_id = model_id
         self.api_provider = api_provider
+        self.chars_per_token = chars_per_token
+        self.response_mode = response_mode or RESPONSE_MODE_SEPARATOR
+        # Gemini's and DeepSeek's OpenAI-compatible endpoints accept response_format; custom servers may reject it.
+        self.use_response_format = use_response_format if use_response_format is not None else api_provider in ("Gemini", "DeepSeek")
+        self.stream = bool(stream)
+        # Instructions go in a system message of their own so providers' prefix caches hit on every batch after the first.
+        self.use_system_prompt = bool(use_system_prompt)
+        self.pool_size = max(pool_size, 1)
+        # Gzip request bodies; only for endpoints known to accept Content-Encoding: gzip.
+        self.compress_requests = bool(compress_requests)
+        self.request_headers = {"Content-Encoding": "gzip"} if self.compress_requests else None
+        self.proxy_url = None
+        # A 429 or an open circuit breaker asking to wait longer than this is returned as an error instead of slept through;
+        # None waits any time.
+        self.max_rate_limit_wait = None
+        # Monotonic time before which the endpoint asked not to be sent anything (Retry-After, open circuit breaker).
+        self.blocked_until = 0.0
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.batch_sizer = AdaptiveBatchSizer(batch_token_budget, chars_per_token)
+        self.metrics = TranslationMetrics()
         self.session = requests.Session()
+        # Keep one pooled connection per concurrent batch so parallel requests don't reconnect.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
         if proxy_config:
             proxy_type = proxy_config.get("type", "http").lower()
@@ -72,8 +526,8 @@ class Translator:
                 logger.warning("代理配置不完整，已忽略。")
             else:
                 auth = f"{username}:{password}@" if username and password else ""
-                proxy_url = f"{proxy_type}://{auth}{address}:{port}"
-                self.session.proxies = {"http": proxy_url, "https": proxy_url}
+                self.proxy_url = f"{proxy_type}://{auth}{address}:{port}"
+                self.session.proxies = {"http": self.proxy_url, "https": self.proxy_url}
                 logger.info(f"翻译器已配置代理: {proxy_type}://{address}:{port}")
 
         if self.api_provider == "Gemini":
@@ -93,14 +547,36 @@ class Translator:
             "Authorization": f"Bearer {self.api_key}"
         })
 
-    def _prepare_payload(self, prompt):
-        return {
+        self.rate_limiter = get_rate_limiter((self.api_url, self.api_key, self.model_id), requests_per_minute, tokens_per_minute)
+        self.circuit_breaker = get_circuit_breaker(self.api_url)
+        if self.rate_limiter:
+            logger.info(f"翻译器已启用客户端限流: RPM={requests_per_minute or '不限'}, TPM={tokens_per_minute or '不限'}")
+
+    @property
+    def streams_segments(self) -> bool:
+        """True if translate_batch reports segments through on_segment before the reply is complete."""
+        return self.stream and self.response_mode == RESPONSE_MODE_JSON
+
+    def _prepare_payload(self, instructions, text):
+        if not instructions:
+            messages = [{"role": "user", "content": text}]
+        elif self.use_system_prompt:
+            messages = [{"role": "system", "content": instructions}, {"role": "user", "content": text}]
+        else:
+            messages = [{"role": "user", "content": f"{instructions}\n{text}"}]
+        payload = {
             "model": self.model_id,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
+            "messages": messages,
+            "stream": self.stream,
             "temperature": 0.1,
             "top_p": 0.9
         }
+        if self.stream:
+            # Without this the token usage of a streamed reply is not reported at all.
+            payload["stream_options"] = {"include_usage": True}
+        if self.response_mode == RESPONSE_MODE_JSON and self.use_response_format:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
 
     def _parse_response(self, response_data):
         try:
@@ -116,82 +592,348 @@ class Translator:
             logger.error(f"解析JSON响应时出错: {e}")
             return "[解析响应时出错]"
 
-    def translate_batch(self, sources: list, prompt_template: str, source_language: str, target_language: str) -> list:
+    def translate_batch(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                        metrics: TranslationMetrics = None, on_segment=None, cancelled: threading.Event = None) -> list:
+        """Returns one translation or error message per source. Request stats go to self.metrics and, if given, to `metrics` as well.
+
+        When streaming in JSON mode, `on_segment(index, translation)` is called from this thread for each segment as soon as it
+        arrives, before the whole list is returned; the returned list still contains every segment.
+
+        Once `cancelled` is set, no further attempt is sent, backoff waits and streamed replies are cut short, and the
+        affected segments come back as CANCELLED_RESULT. A non-streamed request already on the wire still runs to completion."""
+        return self._run(self._translate_flow(sources, prompt_template, source_language, target_language, metrics, on_segment, cancelled))
+
+    def _run(self, flow):
+        """Drives a flow generator: performs each step it yields and sends back the outcome, or throws in the error."""
+        outcome, error = None, None
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(outcome)
+            except StopIteration as stop:
+                return stop.value
+            outcome, error = None, None
+            try:
+                outcome = self._perform(step)
+            except Exception as e:
+                error = e
+            except BaseException:
+                flow.close()
+                raise
+
+    def _perform(self, step):
+        if step[0] == STEP_SLEEP:
+            _, delay, cancelled = step
+            # Waits end early on cancellation.
+            (cancelled.wait if cancelled is not None else time.sleep)(delay)
+            return None
+        return self._send(*step[1:])
+
+    def _translate_flow(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                        metrics: TranslationMetrics = None, on_segment=None, cancelled: threading.Event = None, resize: bool = True):
+        """translate_batch as a flow generator (see _request_flow), shared by both engines. Bisected and resent
+        sub-batches are part of the original batch, so only its first request resizes later batches."""
         if not sources:
             return []
 
-        # Use the unique separator to join the source texts
-        text_to_translate = LINE_SEPARATOR.join(sources)
-        final_prompt = prompt_template.format(
-            source_language=source_language,
-            target_language=target_language,
-            text_to_translate=text_to_translate,
-            line_separator=LINE_SEPARATOR
-        )
-        
-        payload = self._prepare_payload(final_prompt)
+        def shifted(indexes):
+            # Maps indexes of a sub-batch back onto this batch for the caller's on_segment.
+            return (lambda i, translation: on_segment(indexes[i], translation)) if on_segment else None
+
+        try:
+            translations = yield from self._request_flow(sources, prompt_template, source_language, target_language, metrics, on_segment, cancelled,
+                                                         resize)
+        except LineCountMismatchError as e:
+            if len(sources) == 1:
+                return [str(e)]
+            # Bisect so that only the segments the model actually garbles end up failed.
+            mid = len(sources) // 2
+            logger.warning(f"{e} 拆分为 {mid} 行和 {len(sources) - mid} 行两个子批次重试。")
+            first = yield from self._translate_flow(sources[:mid], prompt_template, source_language, target_language, metrics, on_segment,
+                                                    cancelled, resize=False)
+            second = yield from self._translate_flow(sources[mid:], prompt_template, source_language, target_language, metrics,
+                                                     shifted(range(mid, len(sources))), cancelled, resize=False)
+            return first + second
+
+        # In JSON mode the ids the model left out come back as None; only those are sent again.
+        missing = [i for i, t in enumerate(translations) if t is None]
+        if missing:
+            retried = yield from self._translate_flow([sources[i] for i in missing], prompt_template, source_language, target_language, metrics,
+                                                      shifted(missing), cancelled, resize=False)
+            for i, translation in zip(missing, retried):
+                translations[i] = translation
+        return translations
+
+    def _build_request(self, sources: list, prompt_template: str, source_language: str, target_language: str):
+        """Returns the request body and the estimated token cost of prompt and reply."""
+        if self.response_mode == RESPONSE_MODE_JSON:
+            if LINE_SEPARATOR in prompt_template:
+                # The prompt was written for the separator protocol and would contradict the JSON instructions.
+                prompt_template = DEFAULT_JSON_PROMPT_TEMPLATE
+            text_to_translate = json.dumps([{"id": i, "text": s} for i, s in enumerate(sources)], ensure_ascii=False)
+        else:
+            # Use the unique separator to join the source texts
+            text_to_translate = LINE_SEPARATOR.join(sources)
+        instructions, text = split_prompt(prompt_template, source_language, target_language, text_to_translate)
+
+        payload = self._prepare_payload(instructions, text)
+        # Serialize once, without ASCII escaping: Cyrillic and CJK text would otherwise triple in size.
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        if self.compress_requests:
+            body = gzip.compress(body, compresslevel=5)
+        # Output is about as long as the source text, so budget for both directions.
+        estimated_tokens = (estimate_tokens(instructions, self.chars_per_token) + estimate_tokens(text, self.chars_per_token)
+                            + estimate_tokens(text_to_translate, self.chars_per_token))
+        return body, estimated_tokens
+
+    def _request_flow(self, sources: list, prompt_template: str, source_language: str, target_language: str,
+                      metrics: TranslationMetrics = None, on_segment=None, cancelled: threading.Event = None, resize: bool = True):
+        """Sends one request for the whole batch, with retries; raises LineCountMismatchError when the segment count is off.
+        Its latency and line count feed the batch sizer unless `resize` is False.
+
+        A generator, so that the synchronous and the async engine share one control flow: it yields (STEP_SLEEP, seconds,
+        cancelled) and (STEP_SEND, body, count, on_segment, stats, cancelled) steps, is sent None after a sleep and
+        (content, usage, {index: translation} already streamed) after a send, and has the transport's exception
+        thrown in when a send fails. Returns the result list."""
+        body, estimated_tokens = self._build_request(sources, prompt_template, source_language, target_language)
         logger.info(f"--- [开始批量翻译] ({len(sources)} 行) ---")
 
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = self.session.post(self.api_url, json=payload, timeout=180)
-                response.raise_for_status()
-                response_data = response.json()
-                
-                raw_content = self._parse_response(response_data)
-                
-                if raw_content.startswith("[") and raw_content.endswith("]"):
-                    logger.error(f"API返回解析错误: {raw_content}")
-                    return [raw_content] * len(sources)
-
-                # Split the response using the unique separator
-                translations = raw_content.split(LINE_SEPARATOR)
-                
-                if len(translations) == len(sources):
-                    logger.info(f"--- [批量翻译成功] ({len(translations)} 行) ---")
-                    return [t.strip() for t in translations]
-                else:
-                    error_msg = f"[翻译结果行数校验失败] 预期 {len(sources)} 行, 收到 {len(translations)} 行。"
-                    logger.error(error_msg)
-                    logger.debug(f"原始返回内容: {raw_content}")
-                    return [error_msg] * len(sources)
-
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429 and attempt < max_retries - 1:
-                    retry_delay = 60
-                    try:
-                        error_json = e.response.json()
-                        if isinstance(error_json, dict):
-                            details = error_json.get('error', {}).get('details', [])
-                            for detail in details:
-                                if detail.get('@type') == 'type.googleapis.com/google.rpc.RetryInfo':
-                                    delay_str = detail.get('retryDelay', '60s')
-                                    if 's' in delay_str:
-                                        retry_delay = int(delay_str.replace('s', ''))
-                                    break
-                    except Exception:
-                        pass
-                    
-                    logger.warning(f"触发API速率限制。将在 {retry_delay} 秒后重试 (尝试 {attempt + 2}/{max_retries})...")
-                    time.sleep(retry_delay)
-                else:
-                    error_message = f"[HTTP错误 {e.response.status_code}]"
+        stats = RequestStats(model_id=self.model_id, segments=len(sources), payload_bytes=len(body))
+        try:
+            for attempt in range(self.retry_policy.max_attempts):
+                refused = self._refusal(sources, stats, attempt, cancelled)
+                if refused is None:
+                    refused = yield from self._hold_while_open(sources, stats, cancelled)
+                if refused:
+                    return refused
+                try:
+                    if self.rate_limiter:
+                        waited = 0.0
+                        while True:
+                            wait = self.rate_limiter.try_acquire(estimated_tokens)
+                            if wait <= 0:
+                                break
+                            if cancelled is not None and cancelled.is_set():
+                                raise BatchCancelled()
+                            yield (STEP_SLEEP, wait, cancelled)
+                            waited += wait
+                        stats.queue_wait += waited
+                        if waited > 0:
+                            logger.debug(f"客户端限流等待 {waited:.1f} 秒。")
+                    raw_content, usage, streamed = yield (STEP_SEND, body, len(sources), on_segment, stats, cancelled)
                     try:
-                        error_json = e.response.json()
-                        error_details = error_json.get('error', {}).get('message', str(error_json))
-                    except json.JSONDecodeError:
-                        error_details = e.response.text
-                    error_message += f": {error_details}"
-                    logger.critical(f"批量翻译失败: {error_message}")
-                    return [error_message] * len(sources)
-            
-            except requests.exceptions.RequestException as e:
-                logger.critical(f"网络层请求API失败: {e}")
-                return [f"[网络错误: {e}]"] * len(sources)
-            
-            except Exception as e:
-                logger.critical(f"处理API时发生未知错误: {e}", exc_info=True)
-                return [f"[未知错误: {e}]"] * len(sources)
+                        return self._accept_reply(sources, raw_content, usage, streamed, estimated_tokens, stats)
+                    finally:
+                        if resize and (stats.status == "ok" or stats.mismatched):
+                            self.batch_sizer.record(stats.latency, mismatched=stats.mismatched)
+
+                except self._status_errors as e:
+                    outcome = self._on_http_error(e.response, sources, attempt, stats)
+                    if isinstance(outcome, list):
+                        return outcome
+                    yield (STEP_SLEEP, outcome, cancelled)
+
+                except BatchCancelled:
+                    return self._on_cancelled(sources, stats)
+
+                except self._retryable_errors as e:
+                    outcome = self._on_network_error(e, sources, attempt, stats, cancelled)
+                    if isinstance(outcome, list):
+                        return outcome
+                    yield (STEP_SLEEP, outcome, cancelled)
+
+                except self._transport_errors as e:
+                    # Bad URL, unreadable body and the like: retrying won't help, but they say nothing about the endpoint being down.
+                    self.circuit_breaker.record_success()
+                    logger.critical(f"网络层请求API失败: {e}")
+                    return [f"[网络错误: {e}]"] * len(sources)
+
+                except LineCountMismatchError:
+                    raise
+
+                except Exception as e:
+                    self.circuit_breaker.record_success()
+                    logger.critical(f"处理API时发生未知错误: {e}", exc_info=True)
+                    return [f"[未知错误: {e}]"] * len(sources)
+
+            return ["[批量翻译失败: 已达到最大重试次数]"] * len(sources)
+        except GeneratorExit:
+            # The engine gave up on the request, e.g. its asyncio task was cancelled.
+            self.circuit_breaker.record_abandoned()
+            stats.status = "cancelled"
+            raise
+        finally:
+            self.metrics.record(stats)
+            if metrics is not None:
+                metrics.record(stats)
+
+    def _send(self, body: bytes, count: int, on_segment, stats: RequestStats, cancelled: threading.Event = None):
+        """Posts one request; returns (content, usage, {index: translation} already passed to on_segment)."""
+        started = time.monotonic()
+        # When streaming, the timeout applies between chunks rather than to the whole reply.
+        response = self.session.post(self.api_url, data=body, headers=self.request_headers, timeout=180, stream=self.stream)
+        if self.stream:
+            response.raise_for_status()
+            return self._read_stream(response, count, on_segment, stats, started, cancelled)
+        stats.latency = time.monotonic() - started
+        response.raise_for_status()
+        response_data = response.json()
+        return self._parse_response(response_data), response_data.get('usage') or {}, {}
+
+    def _refusal(self, sources: list, stats: RequestStats, attempt: int, cancelled: threading.Event = None):
+        """Starts an attempt; returns the result to give up with if the batch was cancelled, otherwise None."""
+        stats.retries = attempt
+        stats.status = "error"
+        if cancelled is not None and cancelled.is_set():
+            stats.status = "cancelled"
+            return [CANCELLED_RESULT] * len(sources)
+        return None
+
+    def _hold_while_open(self, sources: list, stats: RequestStats, cancelled: threading.Event = None):
+        """Flow step that holds the batch while the endpoint's circuit breaker is open, until it goes out as the next
+        probe or the breaker closes. Returns the result to give up with instead, or None.
+
+        Batches are refused at once, as before, when the probe pause has grown to max_reset_timeout, and for a
+        Translator that must not wait that long (see max_rate_limit_wait), so that a TranslatorPool can reroute them."""
+        breaker = self.circuit_breaker
+        held = 0.0
+        while not breaker.allow():
+            self.blocked_until = max(self.blocked_until, breaker.retry_at)
+            # Past retry_at another batch is probing; its outcome decides, so check back shortly.
+            delay = max(breaker.retry_at - time.monotonic(), 0.0) or BREAKER_POLL_INTERVAL
+            # After probes have failed long enough for the pause to reach its cap, the endpoint counts as down.
+            down = breaker.reset_timeout >= breaker.max_reset_timeout
+            if down or (self.max_rate_limit_wait is not None and delay > self.max_rate_limit_wait):
+                logger.error(f"接口 {self.api_url} 处于熔断状态，跳过本批次 ({len(sources)} 行)。")
+                return [f"[接口熔断: 接口暂不可用，约 {delay:.0f} 秒后再试探]"] * len(sources)
+            if cancelled is not None and cancelled.is_set():
+                stats.status = "cancelled"
+                return [CANCELLED_RESULT] * len(sources)
+            if not held:
+                logger.warning(f"接口 {self.api_url} 处于熔断状态，本批次 ({len(sources)} 行) 等待试探结果后再发送。")
+            yield (STEP_SLEEP, delay, cancelled)
+            held += delay
+        stats.backoff_wait += held
+        return None
+
+    def _accept_reply(self, sources: list, raw_content: str, usage: dict, streamed: dict, estimated_tokens: int, stats: RequestStats) -> list:
+        """Checks a complete reply against the batch; raises LineCountMismatchError when the segment count is off."""
+        self.circuit_breaker.record_success()
+        stats.prompt_tokens = usage.get('prompt_tokens') or 0
+        stats.completion_tokens = usage.get('completion_tokens') or 0
+        stats.cached_tokens = cached_prompt_tokens(usage)
+        if self.rate_limiter:
+            self.rate_limiter.settle_tokens(estimated_tokens, usage.get('total_tokens'))
+        
+        if is_error_result(raw_content):
+            logger.error(f"API返回解析错误: {raw_content}")
+            return [raw_content] * len(sources)
+
+        if self.response_mode == RESPONSE_MODE_JSON:
+            return self._accept_json(sources, raw_content, stats, streamed)
+
+        # Split the response using the unique separator
+        translations = raw_content.split(LINE_SEPARATOR)
         
-        return ["[批量翻译失败: 已达到最大重试次数]"] * len(sources)
\ No newline at end of file
+        if len(translations) == len(sources):
+            stats.status = "ok"
+            logger.info(f"--- [批量翻译成功] ({len(translations)} 行) ---")
+            return [t.strip() for t in translations]
+        self._raise_mismatch(stats, len(sources), len(translations), raw_content)
+
+    def _on_http_error(self, response, sources: list, attempt: int, stats: RequestStats):
+        """Returns the seconds to wait before retrying an error status, or the result to give up with."""
+        policy = self.retry_policy
+        status = response.status_code
+        # Only server-side failures say the endpoint is down; a 4xx came from a live server.
+        if status >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        retry_after = retry_after_seconds(response)
+        delay = policy.delay(attempt, retry_after) if status in RETRYABLE_STATUS_CODES else None
+        if status == 429 and retry_after is not None:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        if delay is not None and attempt < policy.max_attempts - 1 and not (status == 429 and self.max_rate_limit_wait is not None and delay > self.max_rate_limit_wait):
+            if status == 429:
+                logger.warning(f"触发API速率限制。将在 {delay:.1f} 秒后重试 (尝试 {attempt + 2}/{policy.max_attempts})...")
+                stats.rate_limit_wait += delay
+            else:
+                logger.warning(f"服务器返回 HTTP {status}。将在 {delay:.1f} 秒后重试 (尝试 {attempt + 2}/{policy.max_attempts})...")
+                stats.backoff_wait += delay
+            return delay
+        error_message = f"[HTTP错误 {status}]"
+        try:
+            error_json = response.json()
+            error_details = error_json.get('error', {}).get('message', str(error_json))
+        except (ValueError, AttributeError):
+            error_details = response.text
+        error_message += f": {error_details}"
+        logger.critical(f"批量翻译失败: {error_message}")
+        return [error_message] * len(sources)
+
+    def _on_network_error(self, error: Exception, sources: list, attempt: int, stats: RequestStats, cancelled: threading.Event = None):
+        """Returns the seconds to wait before retrying a timeout or broken connection, or the result to give up with."""
+        if cancelled is not None and cancelled.is_set():
+            stats.status = "cancelled"
+            return [CANCELLED_RESULT] * len(sources)
+        policy = self.retry_policy
+        self.circuit_breaker.record_failure()
+        if attempt == policy.max_attempts - 1:
+            logger.critical(f"网络层请求API失败: {error}")
+            return [f"[网络错误: {error}]"] * len(sources)
+        delay = policy.delay(attempt)
+        logger.warning(f"网络层请求API失败: {error}。将在 {delay:.1f} 秒后重试 (尝试 {attempt + 2}/{policy.max_attempts})...")
+        stats.backoff_wait += delay
+        return delay
+
+    def _on_cancelled(self, sources: list, stats: RequestStats) -> list:
+        self.circuit_breaker.record_abandoned()
+        stats.status = "cancelled"
+        logger.debug(f"批次 ({len(sources)} 行) 已取消。")
+        return [CANCELLED_RESULT] * len(sources)
+
+    def _raise_mismatch(self, stats: RequestStats, expected: int, received: int, raw_content: str):
+        stats.status = "mismatch"
+        stats.mismatched = True
+        error = LineCountMismatchError(expected, received)
+        logger.error(str(error))
+        logger.debug(f"原始返回内容: {raw_content}")
+        raise error
+
+    def _read_stream(self, response, count: int, on_segment, stats: RequestStats, started: float, cancelled: threading.Event = None):
+        """Consumes a server-sent event stream; returns (content, usage, {index: translation} already passed to on_segment).
+
+        In JSON mode segments are handed to on_segment as they complete. If the stream breaks after some of them
+        arrived, the partial content is returned instead of raising so those segments are kept."""
+        reader = StreamReader(count, self.response_mode == RESPONSE_MODE_JSON, on_segment, stats, started)
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if cancelled is not None and cancelled.is_set():
+                        raise BatchCancelled()
+                    if not reader.feed(line):
+                        break
+            if not reader.complete:
+                raise requests.exceptions.ChunkedEncodingError("流式响应在结束标记之前中断")
+        except requests.exceptions.RequestException as e:
+            if not reader.found:
+                raise
+            logger.warning(f"流式响应中断 ({e})，保留已收到的 {len(reader.found)}/{count} 条译文。")
+        stats.latency = time.monotonic() - started
+        return reader.result()
+
+    def _accept_json(self, sources: list, raw_content: str, stats: RequestStats, streamed: dict = None) -> list:
+        """Keeps every id the reply got right; missing ids are returned as None for translate_batch to resend."""
+        translations = dict(streamed or {})
+        translations.update(parse_json_translations(raw_content, len(sources)))
+        if not translations:
+            self._raise_mismatch(stats, len(sources), 0, raw_content)
+        missing = len(sources) - len(translations)
+        if missing:
+            stats.status = "partial"
+            stats.mismatched = True
+            logger.warning(f"JSON返回缺少 {missing}/{len(sources)} 条译文，仅重试缺失的条目。")
+        else:
+            stats.status = "ok"
+            logger.info(f"--- [批量翻译成功] ({len(sources)} 行) ---")
+        return [translations.get(i) for i in range(len(sources))]
\ No newline at end of file